@@ -0,0 +1,91 @@
+"""
+Aho-Corasick automaton for finding many patterns at once. Compiles a
+list of patterns into a trie with failure links, so that a text can be
+scanned a single time to find every occurrence of every pattern in
+O(|text| + number of matches)
+"""
+from collections import deque
+
+class AhoCorasick(object):
+
+    def __init__(self, patterns):
+        """
+        Empty patterns are ignored, as they match nowhere
+        """
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.matches = [[]]
+        self.output_link = [-1]
+        for i, pattern in enumerate(self.patterns):
+            if pattern != "":
+                self._add_pattern(pattern, i)
+        self._compute_failure_links()
+
+    def __str__(self):
+        return "Aho-Corasick automaton for " + str(len(self.patterns)) + \
+            " patterns with " + str(len(self.goto)) + " states"
+
+    def _new_state(self):
+        self.goto.append({})
+        self.fail.append(0)
+        self.matches.append([])
+        self.output_link.append(-1)
+        return len(self.goto) - 1
+
+    def _add_pattern(self, pattern, pattern_id):
+        """
+        Adds pattern to the trie, recording pattern_id at the state
+        where it ends
+        """
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = self._new_state()
+                self.goto[state][char] = next_state
+            state = next_state
+        self.matches[state].append(pattern_id)
+
+    def _compute_failure_links(self):
+        """
+        Breadth first over the trie, points each state at the state for
+        the longest proper suffix of its string that is also in the
+        trie. output_link skips ahead along failure links to the nearest
+        state where some pattern ends
+        """
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.matches[self.fail[child]]:
+                    self.output_link[child] = self.fail[child]
+                else:
+                    self.output_link[child] = self.output_link[self.fail[child]]
+
+    def search(self, text):
+        """
+        Scans text once and returns a list of (start, pattern_id) pairs
+        for every occurrence of every pattern, ordered by where each
+        occurrence ends
+        """
+        goto, fail = self.goto, self.fail
+        matches, output_link = self.matches, self.output_link
+        patterns = self.patterns
+        found = []
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            hit = state if matches[state] else output_link[state]
+            while hit > 0:
+                for pattern_id in matches[hit]:
+                    found.append((i - len(patterns[pattern_id]) + 1, pattern_id))
+                hit = output_link[hit]
+        return found
@@ -1,31 +1,403 @@
 """
 Implements key word search functionality
-TODO
-- Implement find_first_occurence or find_all_occurence
 """
-import sys
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import gcd
 
 import numpy as np
 
-from SuffixTreeEfficient import SuffixTreeEfficient
+import IndexCache
+from AhoCorasick import AhoCorasick
+from GeneralizedSuffixIndex import GeneralizedSuffixIndex, KINDS
+from Instrumentation import Instrumentation, phase
+from LRUCache import LRUCache
+from SuffixArrayEfficient import SEPARATOR, TERMINAL
+
+# Step taken through the grid when reading each type of line forwards
+STEPS = {"rows": (0, 1), "cols": (1, 0), "diag_down": (1, 1), "diag_up": (-1, 1)}
+FAMILIES = tuple(STEPS)
+
+# Directions reported in match records. The first four read each family
+# of lines forwards and the last four read them backwards
+DIRECTIONS = ("right", "down", "down_right", "up_right",
+              "left", "up", "up_left", "down_left")
+
+# Record layout of the structured arrays returned with as_array set.
+# direction indexes into DIRECTIONS
+MATCH_DTYPE = np.dtype([("word_id", np.int32),
+                        ("start_row", np.int32), ("start_col", np.int32),
+                        ("end_row", np.int32), ("end_col", np.int32),
+                        ("direction", np.int8)])
+
+# Records returned by find_word_approx, which also count the letters of
+# each match that differ from the word
+APPROX_MATCH_DTYPE = np.dtype(MATCH_DTYPE.descr + [("mismatches", np.int16)])
+
+WRAPS = (None, "torus", "raster")
+
+# find_words switches to a single Aho-Corasick pass over the grid for
+# word lists at least this long, and only once there are enough words to
+# pay for scanning every indexed character: a word searched on its own
+# costs about as much as scanning this many characters (measured with
+# python benchmark.py --batch-crossover)
+BATCH_THRESHOLD = 64
+BATCH_CHARS_PER_WORD = 1000
+
+# Number of query results kept by default
+CACHE_SIZE = 1024
+
+# Orders in which find_k can return matches: "row_major" by start cell
+# and then direction, or "direction" as find_word lists them
+ORDERS = ("row_major", "direction")
+
+# Start cells checked at a time when find_k scans in row-major order
+SCAN_CHUNK = 256
+
+def _build_index_arrays(lines, kind):
+    """
+    Builds an index over lines in a worker process and returns it as
+    arrays, which pickle far more cheaply than a graph of tree nodes
+    """
+    return GeneralizedSuffixIndex(lines, kind).to_arrays()
 
 class BaseWordSearch(object):
 
-    def __init__(self, filename):
-        self.grid = self._load_csv(filename)
-        self.board = self.grid.copy()
-        self.rows = len(self.grid)
-        self.cols = len(self.grid[0])
-        self.suffix_trees = self._make_suffix_trees_from_grid()
+    def __init__(self, filename, index="tree", backwards=False, wrap=None,
+                 cache_dir=None, workers=None, cache_size=CACHE_SIZE,
+                 instrument=False, stats_callback=None):
+        """
+        index selects how the grid lines are searched: "tree" builds a
+        suffix tree, "compact" builds a suffix tree stored in flat
+        arrays, and "array" searches the suffix array directly, which
+        is quickest to build and uses the least memory.
+        With backwards set, words are also matched right to left, bottom
+        to top and along both diagonals in reverse, for eight directions
+        in total.
+        With wrap set to "torus", rows, columns and diagonals continue
+        from the edge of the grid back around to the other side. With
+        wrap set to "raster", a match reaching the end of a row continues
+        at the start of the next row, and likewise for columns, so the
+        grid is indexed as one row-major and one column-major string.
+        With cache_dir set, the built index is saved there under a hash
+        of the grid contents, and later searches over the same grid
+        memory map it back in instead of rebuilding it.
+        Each family of lines (rows, columns and both diagonals) has its
+        own index, built the first time that family is searched. warm()
+        builds them up front. With workers set, every family is indexed
+        straight away in that many worker processes, giving the same
+        indexes as building them one after another.
+        The results of the last cache_size distinct queries are kept,
+        and repeated queries are answered without searching until the
+        grid is next changed.
+        With instrument set, time spent loading, indexing and searching
+        is recorded phase by phase along with counts of the work done,
+        and reported by stats(). stats_callback, which implies
+        instrument, is called with each measurement as it is made, see
+        Instrumentation
+        """
+        if wrap not in WRAPS:
+            raise ValueError("Unknown wrap mode: " + str(wrap))
+        if index not in KINDS:
+            raise ValueError("Unknown index kind: " + str(index))
+        self.index_kind = index
+        self.backwards = backwards
+        self.wrap = wrap
+        self.instrumentation = None
+        if instrument or stats_callback is not None:
+            self.instrumentation = Instrumentation(stats_callback)
+        with phase(self.instrumentation, "load_grid"):
+            self.codes = self._load_csv(filename)
+        self.rows, self.cols = self.codes.shape
+        self._grid = None
+        self.matched = np.zeros(self.codes.shape, dtype=bool)
+        with phase(self.instrumentation, "make_lines"):
+            self._make_line_table()
+        self.indexes = {}
+        self.line_overlays = {}
+        self.grid_version = 0
+        self.query_cache = LRUCache(cache_size)
+        self.query_cache_version = self.grid_version
+        if cache_dir is not None:
+            self._load_or_build_index(cache_dir, workers)
+        elif workers is not None:
+            self.warm(workers=workers)
+
+    @property
+    def grid(self):
+        """
+        The grid as an array of one character strings, decoded from
+        self.codes the first time it is needed
+        """
+        if self._grid is None:
+            self._grid = np.vectorize(chr, otypes=["U1"])(self.codes)
+        return self._grid
+
+    @property
+    def board(self):
+        """
+        The grid with every letter matched so far lowercased
+        """
+        return np.where(self.matched, np.char.lower(self.grid), self.grid)
+
+    def _make_line_table(self):
+        """
+        Lists every line of the grid by family without indexing any of
+        them, numbering the lines of all families consecutively
+        """
+        self.line_arrays = self._make_lines_from_grid()
+        self.line_table = [(_type, i) for _type, lines in self.line_arrays.items()
+                           for i in range(len(lines))]
+        self.line_lengths = np.array([len(line) for lines in self.line_arrays.values()
+                                      for line in lines], dtype=np.int64)
+        self._make_line_geometry()
+
+    def _check_families(self, families):
+        """
+        Returns the given families, or all of them if None, in the order
+        their lines are numbered. Raises ValueError on an unknown family
+        """
+        if families is None:
+            return FAMILIES
+        for _type in families:
+            if _type not in FAMILIES:
+                raise ValueError("Unknown line family: " + str(_type))
+        return [_type for _type in FAMILIES if _type in families]
+
+    def _family_lines(self, tree_type):
+        """
+        Returns the text indexed for each line of a family
+        """
+        return [self._indexed_text(line) for line in self.line_arrays[tree_type]]
+
+    def _indexed_text(self, line):
+        text = self._line_text(line)
+        if self.wrap == "torus":
+            text = self._unroll_cycle(text)
+        return text
+
+    def _family_index(self, tree_type):
+        """
+        Returns the index of a family, building it if not yet built
+        """
+        if tree_type not in self.indexes:
+            self.warm([tree_type])
+        return self.indexes[tree_type]
+
+    def warm(self, families=None, workers=None):
+        """
+        Builds the indexes of the given families, or of every family,
+        now rather than on first search. With workers set they are built
+        in that many worker processes
+        """
+        families = [_type for _type in self._check_families(families)
+                    if _type not in self.indexes]
+        if families:
+            with phase(self.instrumentation, "build_index"):
+                self._build_indexes(families, workers)
+
+    def _build_indexes(self, families, workers):
+        kind, instrumentation = self.index_kind, self.instrumentation
+        if workers is None:
+            for _type in families:
+                self.indexes[_type] = GeneralizedSuffixIndex(self._family_lines(_type),
+                                                             kind, instrumentation)
+            return
+        # Work done in the workers is only seen as time spent building
+        with ProcessPoolExecutor(workers) as pool:
+            built = pool.map(_build_index_arrays,
+                             [self._family_lines(_type) for _type in families],
+                             [kind] * len(families))
+            for _type, arrays in zip(families, built):
+                self.indexes[_type] = GeneralizedSuffixIndex.from_arrays(arrays, kind,
+                                                                         instrumentation)
+
+    def set_cell(self, row, col, letter):
+        """
+        Replaces the letter at (row, col). See update_region. Raises
+        ValueError unless letter is a single character
+        """
+        if len(letter) != 1:
+            raise ValueError("Cells must be single characters: " + repr(letter))
+        self.update_region(row, col, [[letter]])
+
+    def update_region(self, row, col, letters):
+        """
+        Overwrites the block of cells whose top left corner is (row, col)
+        with letters, a list of equal length strings, one per row of the
+        block. Changed cells are no longer marked as matched.
+        Only the lines through changed cells are reindexed: each gets a
+        small index of its own which overrides that line in its family's
+        index. Once more than half of a family's lines are overridden,
+        the family index is dropped instead, and rebuilt on next use.
+        Raises ValueError if the block does not fit in the grid or holds
+        anything but single characters other than the separator and
+        the terminal
+        """
+        letters = [list(line) for line in letters]
+        if len(letters) == 0 or len(letters[0]) == 0 or \
+                any(len(line) != len(letters[0]) for line in letters):
+            raise ValueError("Letters must form a non-empty rectangular block")
+        if row < 0 or col < 0 or row + len(letters) > self.rows or \
+                col + len(letters[0]) > self.cols:
+            raise ValueError("Block at " + str((row, col)) + " does not fit in the grid")
+        if any(len(c) != 1 or c in (SEPARATOR, TERMINAL) for line in letters for c in line):
+            raise ValueError("Cells must be single characters other than " +
+                             SEPARATOR + " and " + TERMINAL)
+
+        block = np.array([[ord(c) for c in line] for line in letters], dtype=np.uint32)
+        widened = block.max() > np.iinfo(self.codes.dtype).max
+        if widened:
+            dtype = np.uint16 if block.max() <= 0xFFFF else np.uint32
+            self.codes = self.codes.astype(dtype)
+        region = (slice(row, row + block.shape[0]), slice(col, col + block.shape[1]))
+        changed_rows, changed_cols = np.nonzero(self.codes[region] != block)
+        if len(changed_rows) == 0:
+            return
+        self.codes[region] = block
+        self._grid = None
+        self.grid_version += 1
+        changed_rows, changed_cols = changed_rows + row, changed_cols + col
+        self.matched[changed_rows, changed_cols] = False
+        # Lines read out of views of self.codes already hold the new
+        # letters, but wrapped lines are copies and are read out again
+        if self.wrap is not None or widened:
+            self.line_arrays = self._make_lines_from_grid()
+
+        for _type, lines in self._lines_through(changed_rows, changed_cols).items():
+            if _type in self.indexes:
+                self._override_lines(_type, lines)
+
+    def _lines_through(self, rows, cols):
+        """
+        Returns a dict mapping each family to the distinct numbers, in
+        its own numbering, of its lines passing through the given cells
+        """
+        if self.wrap == "torus":
+            num_diags = gcd(self.rows, self.cols)
+            diag_down, diag_up = (cols - rows) % num_diags, (cols + rows) % num_diags
+        else:
+            diag_down, diag_up = cols - rows + self.rows - 1, cols + rows
+        if self.wrap == "raster":
+            rows = cols = np.zeros(len(rows), dtype=np.int64)
+        lines = {"rows": rows, "cols": cols, "diag_down": diag_down, "diag_up": diag_up}
+        return {_type: np.unique(lines[_type]).tolist() for _type in FAMILIES}
+
+    def _override_lines(self, tree_type, lines):
+        """
+        Indexes the current text of the given lines of a family on their
+        own, to be searched in place of the family index for them
+        """
+        overlays = self.line_overlays.setdefault(tree_type, {})
+        first = self.family_first[tree_type]
+        for i in lines:
+            text = self._indexed_text(self.line_arrays[tree_type][i])
+            overlays[first + i] = GeneralizedSuffixIndex([text], self.index_kind,
+                                                         self.instrumentation)
+        if 2 * len(overlays) > len(self.line_arrays[tree_type]):
+            self._drop_index(tree_type)
+
+    def _drop_index(self, tree_type):
+        self.indexes.pop(tree_type, None)
+        self.line_overlays.pop(tree_type, None)
+
+    def _make_line_geometry(self):
+        """
+        Tabulates the cell each indexed line starts from, the step taken
+        along it and its family, so that the coordinates of any number
+        of matches can be computed at once
+        """
+        self.line_origins = np.array([self._line_origin(_type, i)
+                for _type, i in self.line_table], dtype=np.int64).reshape(-1, 2)
+        self.line_families = np.array([FAMILIES.index(_type)
+                for _type, _ in self.line_table], dtype=np.int8)
+        steps = np.array([STEPS[_type] for _type in FAMILIES], dtype=np.int64)
+        self.line_steps = steps[self.line_families]
+        # Lines of each family are numbered consecutively, from here
+        self.family_first = {}
+        for k, (_type, _) in enumerate(self.line_table):
+            self.family_first.setdefault(_type, k)
+
+    def _line_origin(self, tree_type, i):
+        """
+        Returns the grid cell at which the i-th line of a family begins.
+        Diagonals run from the bottom left (down) or top left (up) cell
+        along the first column and then along the first or last row. On
+        a torus every diagonal starts on the first row, and in raster
+        mode the single row-major and column-major lines start at (0, 0)
+        """
+        if tree_type == "rows":
+            return i, 0
+        if tree_type == "cols" or self.wrap == "torus":
+            return 0, i
+        main_diag_pos = self.rows - 1
+        col = max(i - main_diag_pos, 0)
+        if tree_type == "diag_down":
+            return max(main_diag_pos - i, 0), col
+        return min(i, main_diag_pos), col
+
+    def _load_or_build_index(self, cache_dir, workers=None):
+        """
+        Loads the index for this grid from cache_dir if it has been
+        saved there, otherwise builds it and saves it
+        """
+        key = IndexCache.cache_key(self.codes, index=self.index_kind, wrap=self.wrap)
+        path = IndexCache.cache_path(cache_dir, key)
+        if os.path.exists(path):
+            try:
+                self.load_index(path)
+                return
+            except ValueError:
+                pass
+        self.warm(workers=workers)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.save_index(path)
+
+    def save_index(self, path):
+        """
+        Saves the index of every family to path, from where load_index
+        can read it back for the same grid. Families not yet built are
+        built first. Suffix trees are saved in compact form, so loading
+        them builds no nodes
+        """
+        for _type in list(self.line_overlays):
+            self._drop_index(_type)
+        self.warm()
+        meta = {"index": self.index_kind, "wrap": self.wrap,
+                "shape": [self.rows, self.cols]}
+        arrays = {}
+        for _type, index in self.indexes.items():
+            for name, arr in index.to_arrays(node_arrays=True).items():
+                arrays[_type + "." + name] = arr
+        IndexCache.save_arrays(path, meta, arrays)
+
+    def load_index(self, path):
+        """
+        Replaces the index with one saved by save_index. Raises
+        ValueError if it was saved for a different grid shape or mode
+        """
+        with phase(self.instrumentation, "load_index"):
+            meta, arrays = IndexCache.load_arrays(path)
+            if meta["shape"] != [self.rows, self.cols] or meta["wrap"] != self.wrap:
+                raise ValueError("Index file " + path + " was saved for a different grid")
+            self.index_kind = meta["index"]
+            self.line_overlays = {}
+            arrays_by_type = {}
+            for name, arr in arrays.items():
+                _type, name = name.split(".", 1)
+                arrays_by_type.setdefault(_type, {})[name] = arr
+            self.indexes = {_type: GeneralizedSuffixIndex.from_arrays(
+                                arrays_by_type[_type], meta["index"], self.instrumentation)
+                            for _type in FAMILIES}
 
     def __str__(self):
-        # display self.text for all suffix trees
+        # display the text of every grid line, grouped by family. The
+        # lines are read from the grid, so no index is built
         s = ""
-        for _type in self.suffix_trees:
+        for _type, lines in self.line_arrays.items():
             s = s + _type + "\n"
-            for tree in self.suffix_trees[_type]:
-                endchar = len(tree.text) - 1
-                s = s + tree.text[:endchar] + "\n"
+            for line in lines:
+                s = s + self._line_text(line) + "\n"
 
         endchar = len(s) - 1 # To chop off trailing newline
         return s[:endchar]
@@ -33,389 +405,683 @@ class BaseWordSearch(object):
     def show_board(self, silent=False):
         """
         Display search results from all found words so far.
-        Lowercased letters are letter which have been matched against.
+        Lowercased letters are letter which have been matched against,
+        as recorded in the matched mask.
         Can be run in silent mode to simply return the string
         representation of the board
         """
-        s = ""
-        for i in range(self.rows):
-            for j in range(self.cols):
-                s += self.board[i][j] + " "
-            if i != self.rows - 1:
-                s += "\n"
+        letters, inverse = np.unique(self.codes, return_inverse=True)
+        shown = np.array([chr(c) for c in letters] + [chr(c).lower() for c in letters],
+                         dtype=object)
+        cells = shown[inverse.reshape(self.codes.shape) + len(letters) * self.matched]
+        s = "\n".join(" ".join(row) + " " for row in cells)
         if not silent:
             print(repr(s))
         return s
 
     def _load_csv(self, filename):
-        grid = []
-        infile = open(filename)
-        for line in infile:
-            line = line.strip().split(',')
-            grid.append(line)
-        infile.close()
-        return np.array(grid)
-
-    def _tree_setup(self, string):
-        """
-        Creates and initializes a SuffixTreeEfficient object given a
-        string. Returns the object
-        """
-        st = SuffixTreeEfficient(string)
-        st.create_suffix_tree()
-        return st
-
-    def _make_suffix_trees_from_grid(self):
-        num_rows = len(self.grid)
-        num_cols = len(self.grid[0])
-        rows = self._make_suffix_trees_from_rows(num_rows)
-        cols = self._make_suffix_trees_from_cols(num_cols)
-        diag_down = self._make_suffix_trees_from_diags_down(num_rows, num_cols)
-        diag_up = self._make_suffix_trees_from_diags_up(num_rows, num_cols)
-        return {"rows": rows, "cols": cols, "diag_down": diag_down, "diag_up": diag_up}
-
-    def _make_suffix_trees_from_rows(self, num_rows):
-        trees = []
-        for i in range(num_rows):
-            s = ''.join(self.grid[i])
-            trees.append(self._tree_setup(s))
-        return trees
-
-    def _make_suffix_trees_from_cols(self, num_cols):
-        trees = []
-        grid_copy = self.grid.T
-        for i in range(num_cols):
-            s = ''.join(grid_copy[i])
-            trees.append(self._tree_setup(s))
-        return trees
-
-    def _make_suffix_trees_from_diags_down(self, num_rows, num_cols):
-        return self._diags_down(num_rows, num_cols)
-
-    def _make_suffix_trees_from_diags_up(self, num_rows, num_cols):
-        return self._diags_up(num_rows, num_cols)
-
-    def _diags_down(self, num_rows, num_cols):
-        trees = []
-        for i in range(num_rows-1, -1, -1):
-            diag = self._trace_diagonal_down_from(num_rows, num_cols, i, 0)
-            trees.append(self._tree_setup(diag))
-        for i in range(1, num_cols):
-            diag = self._trace_diagonal_down_from(num_rows, num_cols, 0, i)
-            trees.append(self._tree_setup(diag))
-        return trees
-
-    def _diags_up(self, num_rows, num_cols):
-        trees = []
-        for i in range(num_rows):
-            diag = self._trace_diagonal_up_from(num_rows, num_cols, i, 0)
-            trees.append(self._tree_setup(diag))
-        for i in range(1, num_cols):
-            diag = self._trace_diagonal_up_from(num_rows, num_cols, num_rows-1, i)
-            trees.append(self._tree_setup(diag))
-        return trees
-
-    def _trace_diagonal_up_from(self, max_row, max_col, row, col):
-        letters = []
-        while row >= 0 and col < max_col:
-            letters.append(self.grid[row][col])
-            row -= 1
-            col += 1
-        return ''.join(letters)
-
-    def _trace_diagonal_down_from(self, max_row, max_col, row, col):
-        letters = []
-        while row < max_row and col < max_col:
-            letters.append(self.grid[row][col])
-            row += 1
-            col += 1
-        return ''.join(letters)
-
-    def find_word(self, word):
+        """
+        Parses a CSV file of single character cells into a 2-D array of
+        character codes. The file is memory mapped and parsed in bulk:
+        codes are uint8 for ASCII grids, and uint16 or uint32 when the
+        file holds wider UTF-8 characters. Whitespace and blank lines
+        are ignored. Raises ValueError unless every row holds the same
+        number of single character cells, none of them the separator or
+        the terminal that the indexes reserve
+        """
+        if os.path.getsize(filename) == 0:
+            raise ValueError("Grid file " + filename + " is empty")
+        chars = np.memmap(filename, dtype=np.uint8, mode="r")
+        if (chars >= 0x80).any():
+            text = bytes(chars).decode("utf-8")
+            chars = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+
+        is_newline = chars == ord("\n")
+        is_comma = chars == ord(",")
+        is_space = (chars == ord(" ")) | (chars == ord("\t")) | (chars == ord("\r"))
+        is_cell = ~(is_newline | is_comma | is_space)
+        is_token = is_cell | is_comma
+
+        # Within each line, tokens must alternate cell, comma, cell, ...
+        line_of = np.cumsum(is_newline)[is_token]
+        cell_tokens = is_cell[is_token]
+        line_starts = np.flatnonzero(np.diff(line_of, prepend=-1))
+        tokens_per_line = np.diff(np.append(line_starts, len(line_of)))
+        rank = np.arange(len(line_of)) - np.repeat(line_starts, tokens_per_line)
+        if (cell_tokens != (rank % 2 == 0)).any() or (tokens_per_line % 2 == 0).any():
+            raise ValueError("Grid file " + filename +
+                             " must hold single characters separated by commas")
+        cells_per_line = (tokens_per_line + 1) // 2
+        if len(cells_per_line) == 0 or (cells_per_line != cells_per_line[0]).any():
+            raise ValueError("Grid file " + filename + " rows differ in length")
+
+        codes = chars[is_cell]
+        if np.isin(codes, [ord(SEPARATOR), ord(TERMINAL)]).any():
+            raise ValueError("Grid file " + filename + " may not hold " +
+                             SEPARATOR + " or " + TERMINAL)
+        if codes.max() <= 0xFF:
+            codes = codes.astype(np.uint8)
+        elif codes.max() <= 0xFFFF:
+            codes = codes.astype(np.uint16)
+        return codes.reshape(len(cells_per_line), cells_per_line[0])
+
+    def _line_text(self, line):
+        """
+        Decodes a 1-D array of character codes into a string
+        """
+        encoding = {1: "latin-1", 2: "utf-16-le", 4: "utf-32-le"}[line.dtype.itemsize]
+        return line.astype(line.dtype.newbyteorder("<")).tobytes().decode(encoding)
+
+    def _make_lines_from_grid(self):
+        """
+        Returns a dict mapping each family of lines to a list of its
+        rows, columns or diagonals, as arrays of character codes read
+        out of self.codes. Most are views, and none are decoded until
+        the family is indexed
+        """
+        num_rows, num_cols = self.codes.shape
+        if self.wrap == "torus":
+            diag_down = self._torus_diags(num_rows, num_cols, 1)
+            diag_up = self._torus_diags(num_rows, num_cols, -1)
+        else:
+            diag_down = self._make_lines_from_diags_down(num_rows, num_cols)
+            diag_up = self._make_lines_from_diags_up(num_rows, num_cols)
+        if self.wrap == "raster":
+            rows = [self.codes.ravel()]
+            cols = [self.codes.T.ravel()]
+        else:
+            rows = self._make_lines_from_rows(num_rows)
+            cols = self._make_lines_from_cols(num_cols)
+        return {
+            "rows": rows,
+            "cols": cols,
+            "diag_down": diag_down,
+            "diag_up": diag_up,
+        }
+
+    def _make_lines_from_rows(self, num_rows):
+        return [self.codes[i] for i in range(num_rows)]
+
+    def _make_lines_from_cols(self, num_cols):
+        return [self.codes[:, i] for i in range(num_cols)]
+
+    def _make_lines_from_diags_down(self, num_rows, num_cols):
+        """
+        Diagonals running down and right, starting from the bottom left
+        cell, up the first column and then along the first row
+        """
+        return [np.diagonal(self.codes, k) for k in range(-num_rows + 1, num_cols)]
+
+    def _make_lines_from_diags_up(self, num_rows, num_cols):
+        """
+        Diagonals running up and right, starting from the top left cell,
+        down the first column and then along the last row. Each is a
+        down-right diagonal of the vertically flipped grid
+        """
+        flipped = np.flipud(self.codes)
+        return [np.diagonal(flipped, k) for k in range(-num_rows + 1, num_cols)]
+
+    def _torus_diags(self, num_rows, num_cols, step_row):
+        """
+        On a torus each diagonal wraps around until it returns to its
+        starting cell. There are gcd(rows, cols) of them in each
+        direction, and the i-th one passes through (0, i)
+        """
+        num_diags = gcd(num_rows, num_cols)
+        steps = np.arange(num_rows * num_cols // num_diags)
+        return [self.codes[(steps * step_row) % num_rows, (i + steps) % num_cols]
+                for i in range(num_diags)]
+
+    def _unroll_cycle(self, line):
+        """
+        Returns the text indexed for a line that wraps around. Every
+        match that starts within the line and is no longer than it
+        appears in the line followed by all but its last character
+        """
+        return line + line[:len(line)-1]
+
+    def find_word(self, word, as_array=False, families=None):
         """
         Looks for a given word in the grid. Returns a list of tuples,
         containing information about where the word begins and ends.
         The first item in the tuple is the word's beginning location,
-        the second is the word's end location"
-        """
-        loc_info = []
-        for tree_type in self.suffix_trees:
-            for i, tree in enumerate(self.suffix_trees[tree_type]):
-                result = tree.find_pattern(word)
-                if result == []:
-                    continue
-
-                if tree_type == "rows":
-                    for r in result:
-                        beginning = (i, r)
-                        end = (i, r + len(word))
-                        loc_info.append( (beginning, end) )
-
-                elif tree_type == "cols":
-                    for r in result:
-                        beginning = (r, i)
-                        end = (r + len(word), i)
-                        loc_info.append( (beginning, end) )
-
-                elif tree_type == "diag_down":
-                    row, col = self._diag_down_grid_loc_from_index(i)
-                    for r in result:
-                        coords = self._diag_down_get_coords(word, row, col, r)
-                        loc_info.append( coords )
-
-                elif tree_type == "diag_up":
-                    row, col = self._diag_up_grid_loc_from_index(i)
-                    for r in result:
-                        coords = self._diag_up_get_coords(word, row, col, r)
-                        loc_info.append( coords )
-
-        self._update_board(loc_info)
-        return loc_info
-
-    def _diag_down_grid_loc_from_index(self, i):
-        """
-        Given an index (index in the diag_down suffix array), returns
-        the corresponding grid row,col pair location where the match
-        begins.
+        the second is the word's end location.
+        With as_array set, returns a structured array of MATCH_DTYPE
+        records instead, which avoids building a tuple per match.
+        families limits the search to some of "rows", "cols",
+        "diag_down" and "diag_up", and only their indexes are built
         """
-        main_diag_pos = self.rows - 1
-        if i < main_diag_pos:
-            row = self.rows - i - 1
-            col = 0
-        elif i > main_diag_pos:
-            row = 0
-            col = i - main_diag_pos
-        else:
-            row = 0
-            col = 0
-        return row, col
+        families = self._check_families(families)
+        records = self._find_all_records([word], families, batch=False)[0]
+        self._update_board(self._coords_array(records))
+        if as_array:
+            return records
+        return self._coords_from_records(records)
 
-    def _diag_down_get_coords(self, word, row, col, depth):
+    def contains(self, word, families=None):
         """
-        Given the location where the string occurs in the grid and
-        the location in the down suffix array where the string begins,
-        returns the word's beginning and end coordinates in the grid
+        Returns whether word occurs in the grid. Families are searched
+        one at a time, stopping at the first with a match, and no
+        matches are listed or marked on the board
         """
-        beg_r, beg_c = self._diag_down_move_n(row, col, depth)
-        end_r, end_c = self._diag_down_move_n(beg_r, beg_c, len(word))
-        beginning = (beg_r, beg_c)
-        end = (end_r, end_c)
-        return beginning, end
+        return any(n > 0 for n in self._family_counts(word, families))
 
-    def _diag_up_get_coords(self, word, row, col, depth):
+    def count(self, word, families=None):
         """
-        Given the location where the string occurs in the grid and
-        the location in the up suffix array where the string begins,
-        returns the word's beginning and end coordinates in the grid
+        Returns how many times word occurs in the grid, the same as
+        len(find_word(word)), without listing the matches or marking
+        them on the board
         """
-        beg_r, beg_c = self._diag_up_move_n(row, col, depth)
-        end_r, end_c = self._diag_up_move_n(beg_r, beg_c, len(word))
-        beginning = (beg_r, beg_c)
-        end = (end_r, end_c)
-        return beginning, end
+        return sum(self._family_counts(word, families))
 
-    def _diag_up_grid_loc_from_index(self, i):
+    def _family_counts(self, word, families):
         """
-        Given an index (index in the diag_up suffix array), returns
-        the corresponding grid row,col pair location where the match
-        begins.
+        Yields the number of matches of word in each family in turn,
+        followed by the number read backwards if backwards is set
         """
-        main_diag_pos = self.rows - 1
-        if i < main_diag_pos:
-            row = i
-            col = 0
-        elif i > main_diag_pos:
-            row = self.rows - 1
-            col = i - main_diag_pos
-        else:
-            row = self.rows - 1
-            col = 0
-        return row, col
-
-    def _diag_down_move_n(self, row, col, depth):
-        """
-        On a diagonal, moves the row, col variables depth positions
-        down the diagonal
-        """
-        cur_row = row
-        cur_col = col
-        for i in range(depth):
-            cur_row += 1
-            cur_col += 1
-        return cur_row, cur_col
-
-    def _diag_up_move_n(self, row, col, depth):
-        """
-        On a diagonal, moves the row, col variables depth positions
-        down the diagonal
-        """
-        cur_row = row
-        cur_col = col
-        for i in range(depth):
-            cur_row -= 1
-            cur_col += 1
-        return cur_row, cur_col
-
-    def find_words(self, words):
-        self.locations = []
-        for w in words:
-            self.locations.append(self.find_word(w))
-        return self.locations
+        families = self._check_families(families)
+        patterns = [word, word[::-1]] if self.backwards else [word]
+        for pattern in patterns:
+            for _type in families:
+                yield self._count_in_family(_type, pattern)
 
-    def build_string_from_coords(self, coords):
+    def _count_in_family(self, tree_type, word):
         """
-        Given a coords tuple (the begining coords for a string and
-        the end coords for a string), returns the found string
+        Counts matches of word in a family from the size of its suffix
+        array range. Wrapped lines are indexed with part of themselves
+        repeated, and changed lines are overridden, so in those cases
+        the hits are located and checked instead
+        """
+        if self.wrap == "torus" or self.line_overlays.get(tree_type):
+            return len(self._search_family(tree_type, word)[0])
+        return self._family_index(tree_type).count_pattern(word)
+
+    def find_word_approx(self, word, k, families=None, as_array=False):
         """
-        if self._in_row(coords):
-            return self._recover_from_row(coords)
-        elif self._in_col(coords):
-            return self._recover_from_col(coords)
-        elif self._in_diag_down(coords):
-            return self._recover_from_diag_down(coords)
-        elif self._in_diag_up(coords):
-            return self._recover_from_diag_up(coords)
+        Looks for word with up to k of its letters replaced, in every
+        direction find_word searches. Returns a list of
+        (((beg_row, beg_col), (end_row, end_col)), mismatches) tuples
+        ordered as find_word orders its matches, or with as_array set,
+        a structured array of APPROX_MATCH_DTYPE records. Matches are
+        found by a depth first walk of each family's index that shares
+        the work for common prefixes and gives up on a branch once it
+        holds more than k mismatches. The matches are marked on the
+        board
+        """
+        if k < 0:
+            raise ValueError("Number of mismatches must not be negative: " + str(k))
+        families = self._check_families(families)
+        patterns = [(word, False), (word[::-1], True)] if self.backwards else [(word, False)]
+        found = []
+        for pattern, reverse in patterns:
+            find = lambda index: index.find_positions_approx(pattern, k)
+            for _type in families:
+                lines, offsets, mismatches = self._search_family(_type, pattern, find)
+                records = self._match_records(word, lines, offsets, reverse=reverse)
+                approx = np.empty(len(records), dtype=APPROX_MATCH_DTYPE)
+                for name in MATCH_DTYPE.names:
+                    approx[name] = records[name]
+                approx["mismatches"] = mismatches
+                found.append(approx)
+        found = np.concatenate(found) if found else np.empty(0, dtype=APPROX_MATCH_DTYPE)
+
+        self._update_board(self._coords_array(found))
+        if as_array:
+            return found
+        return list(zip(self._coords_from_records(found), found["mismatches"].tolist()))
+
+    def find_first(self, word, order="row_major", families=None):
+        """
+        Returns the ((beg_row, beg_col), (end_row, end_col)) coords of
+        the first match of word in the given order, or None. See find_k
+        """
+        found = self.find_k(word, 1, order, families)
+        return found[0] if found else None
+
+    def find_k(self, word, k, order="row_major", families=None, as_array=False):
+        """
+        Returns the first k matches of word, in the same form as
+        find_word, stopping as soon as k have been found. With order
+        "row_major", matches are ordered by start cell, row by row, and
+        then by direction as numbered in DIRECTIONS. The matches are
+        counted with the indexes first, so a word that is absent costs no
+        more than count. When matches are many, start cells holding the
+        first letter of word are checked in that order, a chunk at a
+        time, against every direction, so the search ends at the chunk
+        holding the k-th match. With order "direction", matches come in
+        the order find_word lists them and families are searched one at
+        a time, so families after the one holding the k-th match are not
+        searched, or built. The matches found are marked on the board
+        """
+        if order not in ORDERS:
+            raise ValueError("Unknown match order: " + str(order))
+        if k < 0:
+            raise ValueError("k must not be negative: " + str(k))
+        families = self._check_families(families)
+        if k == 0:
+            records = np.empty(0, dtype=MATCH_DTYPE)
+        elif order == "row_major":
+            records = self._find_k_row_major(word, k, families)
         else:
-            return ""
+            records = self._find_k_by_direction(word, k, families)
+        self._update_board(self._coords_array(records))
+        if as_array:
+            return records
+        return self._coords_from_records(records)
+
+    def _find_k_by_direction(self, word, k, families):
+        found = []
+        patterns = [(word, False), (word[::-1], True)] if self.backwards else [(word, False)]
+        for pattern, reverse in patterns:
+            for _type in families:
+                lines, offsets = self._search_family(_type, pattern)
+                lines, offsets = lines[:k], offsets[:k]
+                found.append(self._match_records(word, lines, offsets, reverse=reverse))
+                k -= len(lines)
+                if k == 0:
+                    return np.concatenate(found)
+        if not found:
+            return np.empty(0, dtype=MATCH_DTYPE)
+        return np.concatenate(found)
 
-    def _in_row(self, coords):
+    def _find_k_row_major(self, word, k, families):
         """
-        Returns true if a given coords is contained within a row
+        Counts the matches with the indexes first. If there are none,
+        nothing more is done. If there are few, they are all listed and
+        the first k taken. Otherwise matches are common enough that a
+        scan in row-major order soon finds k of them, see _scan_row_major
         """
-        beg_row = coords[0][0]
-        end_row = coords[1][0]
-        return beg_row == end_row
+        if word == "" or not families:
+            return np.empty(0, dtype=MATCH_DTYPE)
+        total = sum(self._family_counts(word, families))
+        if total == 0:
+            return np.empty(0, dtype=MATCH_DTYPE)
+        # Listing costs about total, while the scan reads about k / total
+        # of the grid before stopping
+        if total * total <= k * self.rows * self.cols:
+            records = self._find_all_records([word], families, batch=False)[0]
+            return np.sort(records, order=["start_row", "start_col", "direction"])[:k]
+        return self._scan_row_major(word, k, families)
 
-    def _recover_from_row(self, coords):
+    def _scan_row_major(self, word, k, families):
         """
-        Returns a string from the coords specified built with the grid
+        Checks start cells in row-major order against each allowed
+        direction by reading the cells the word would cover straight out
+        of the grid, wrapped the same way the indexed lines are
         """
-        beg_row, beg_col = coords[0]
-        end_row, end_col = coords[1]
-        length = end_col - beg_col
-        pattern = ""
-        for i in range(length):
-            pattern += self.grid[beg_row][beg_col]
-            beg_col += 1
-        return pattern
+        if max(map(ord, word)) > np.iinfo(self.codes.dtype).max:
+            return np.empty(0, dtype=MATCH_DTYPE)
+        letters = np.array([ord(c) for c in word], dtype=self.codes.dtype)
+        directions = [FAMILIES.index(_type) for _type in families]
+        steps = [STEPS[_type] for _type in families]
+        if self.backwards:
+            directions += [d + len(FAMILIES) for d in directions]
+            steps += [(-d_row, -d_col) for d_row, d_col in steps]
+        directions = np.array(directions, dtype=np.int8)
+        steps = np.array(steps, dtype=np.int64)
+        walk = np.arange(len(word))
+
+        found = []
+        starts = np.flatnonzero(self.codes.ravel() == letters[0])
+        for chunk in range(0, len(starts), SCAN_CHUNK):
+            start_rows, start_cols = np.divmod(starts[chunk:chunk+SCAN_CHUNK], self.cols)
+            # One candidate per start cell and direction, in match order
+            rows = np.repeat(start_rows, len(directions))
+            cols = np.repeat(start_cols, len(directions))
+            step = np.tile(steps, (len(start_rows), 1))
+            direction = np.tile(directions, len(start_rows))
+            fits = self._word_fits(rows, cols, step, len(word))
+            rows, cols, step, direction = rows[fits], cols[fits], step[fits], direction[fits]
+
+            path_rows, path_cols = self._wrap_cells(
+                    rows[:, None] + walk * step[:, 0:1], cols[:, None] + walk * step[:, 1:2],
+                    step[:, 0:1] == 0, step[:, 1:2] == 0)
+            hit = (self.codes[path_rows, path_cols] == letters).all(axis=1)
+            rows, cols, step, direction = rows[hit], cols[hit], step[hit], direction[hit]
+
+            records = np.empty(len(rows), dtype=MATCH_DTYPE)
+            records["word_id"] = 0
+            records["start_row"], records["start_col"] = rows, cols
+            records["end_row"] = rows + len(word) * step[:, 0]
+            records["end_col"] = cols + len(word) * step[:, 1]
+            records["direction"] = direction
+            found.append(records[:k])
+            k -= len(found[-1])
+            if k == 0:
+                break
+        if not found:
+            return np.empty(0, dtype=MATCH_DTYPE)
+        return np.concatenate(found)
 
-    def _in_col(self, coords):
+    def _word_fits(self, rows, cols, step, length):
         """
-        Returns true if a given coords is contained within a column
+        Returns a mask of which candidate matches of the given length,
+        starting at (rows, cols) and moving by step, lie along a single
+        indexed line: inside the grid, within one cycle on a torus, or
+        within the row-major or column-major string in raster mode
         """
-        beg_col = coords[0][1]
-        end_col = coords[1][1]
-        return beg_col == end_col
+        row_span, col_span = step[:, 0] == 0, step[:, 1] == 0
+        end_rows = rows + (length - 1) * step[:, 0]
+        end_cols = cols + (length - 1) * step[:, 1]
+        inside = (end_rows >= 0) & (end_rows < self.rows) & \
+            (end_cols >= 0) & (end_cols < self.cols)
+        if self.wrap == "torus":
+            cycle = np.where(row_span, self.cols, np.where(col_span, self.rows,
+                    self.rows * self.cols // gcd(self.rows, self.cols)))
+            return length <= cycle
+        if self.wrap == "raster":
+            size = self.rows * self.cols
+            by_rows = rows * self.cols + cols + (length - 1) * step[:, 1]
+            by_cols = cols * self.rows + rows + (length - 1) * step[:, 0]
+            return np.where(row_span, (by_rows >= 0) & (by_rows < size),
+                    np.where(col_span, (by_cols >= 0) & (by_cols < size), inside))
+        return inside
 
-    def _recover_from_col(self, coords):
+    def _find_records(self, word, word_id=0, families=None, find_hits=None):
         """
-        Returns a string from the coords specified built with the grid
+        Returns the MATCH_DTYPE records of every match of word. find_hits
+        gives the (lines, offsets) arrays where a pattern occurs, and
+        defaults to searching the indexes of the given families
         """
-        beg_row, beg_col = coords[0]
-        end_row, end_col = coords[1]
-        length = end_row - beg_row
-        pattern = ""
-        for i in range(length):
-            pattern += self.grid[beg_row][beg_col]
-            beg_row += 1
-        return pattern
+        if find_hits is None:
+            families = self._check_families(families)
+            find_hits = lambda pattern: self._find_in_lines(pattern, families)
+        records = [self._match_records(word, *find_hits(word), word_id=word_id)]
+        # A word read backwards along a line is its reverse read forwards,
+        # so the same index answers the four reverse directions
+        if self.backwards:
+            records.append(self._match_records(word, *find_hits(word[::-1]),
+                    word_id=word_id, reverse=True))
+        return np.concatenate(records)
 
-    def _in_diag_down(self, coords):
+    def _find_in_lines(self, word, families=FAMILIES):
         """
-        Returns true if given coords are contained in a downwards
-        diagonal
+        Returns (lines, offsets) arrays of where word occurs in the
+        indexes of families, ordered by line and then by offset
         """
-        beg_row, beg_col = coords[0]
-        end_row, end_col = coords[1]
-        return beg_row < end_row and beg_col < end_col
+        hits = [self._search_family(_type, word) for _type in families]
+        return self._join_hits(hits)
 
-    def _recover_from_diag_down(self, coords):
+    def _search_family(self, tree_type, word, find=None):
         """
-        Returns a string spanning the coords specified built from
-        the grid
+        Returns (lines, offsets) arrays of where word occurs in a family,
+        searching lines changed since the family was indexed in their
+        own overlay indexes. find(index) returns the hits in one index,
+        by default from its find_positions. Any arrays it returns after
+        lines and offsets are carried along with them
         """
-        beg_row, beg_col = coords[0]
-        end_row, end_col = coords[1]
-        length = end_row - beg_row
-        pattern = ""
-        for i in range(length):
-            pattern += self.grid[beg_row][beg_col]
-            beg_row += 1
-            beg_col += 1
-        return pattern
+        if find is None:
+            find = lambda index: index.find_positions(word)
+        hits = self._family_hits(tree_type, word, *find(self._family_index(tree_type)))
+        overlays = self.line_overlays.get(tree_type)
+        if not overlays:
+            return hits
+        keep = ~np.isin(hits[0], list(overlays))
+        joined = [tuple(column[keep] for column in hits)]
+        for k, overlay in overlays.items():
+            found = find(overlay)
+            found = (found[0] + k,) + tuple(found[1:])
+            valid = self._is_valid_hit(word, found[0], found[1])
+            joined.append(tuple(column[valid] for column in found))
+        hits = self._join_hits(joined)
+        order = np.lexsort((hits[1], hits[0]))
+        return tuple(column[order] for column in hits)
 
-    def _in_diag_up(self, coords):
+    def _family_hits(self, tree_type, word, lines, offsets, *extra):
         """
-        Returns true if given coords are contained in an upwards
-        diagonal
+        Given where word occurs in the index of one family of lines,
+        returns the valid hits numbered by line across all families
         """
-        beg_row, beg_col = coords[0]
-        end_row, end_col = coords[1]
-        return beg_row > end_row and beg_col < end_col
+        lines = lines + self.family_first[tree_type]
+        keep = self._is_valid_hit(word, lines, offsets)
+        return tuple(column[keep] for column in (lines, offsets) + extra)
 
-    def _recover_from_diag_up(self, coords):
+    def _join_hits(self, hits, width=2):
         """
-        Returns a string spanning the coords specified built from
-        the grid
+        Concatenates tuples of hit arrays column by column
         """
-        beg_row, beg_col = coords[0]
-        end_row, end_col = coords[1]
-        length = end_col - beg_col
-        pattern = ""
-        for i in range(length):
-            pattern += self.grid[beg_row][beg_col]
-            beg_row -= 1
-            beg_col += 1
-        return pattern
+        if len(hits) == 0:
+            return tuple(np.empty(0, dtype=np.int64) for i in range(width))
+        return tuple(np.concatenate(column) for column in zip(*hits))
 
-    def _update_board(self, loc_info):
+    def _is_valid_hit(self, word, line, r):
+        """
+        A line that wraps around is indexed with part of itself repeated,
+        so only matches starting in its first copy count, and a word may
+        not be longer than the line. Works on arrays of hits too
+        """
+        return (r < self.line_lengths[line]) & (len(word) <= self.line_lengths[line])
+
+    def _match_records(self, word, lines, offsets, word_id=0, reverse=False):
+        """
+        Given matches of word at offsets into indexed lines, returns
+        their MATCH_DTYPE records. The beginning of every match is the
+        start of its line plus offset steps along it, and the end is
+        len(word) steps further on. With reverse set the matches are of
+        the reversed word, and are reported read from their last cell
+        back to their first
         """
-        Given a list of coordinates, finds which characters in the
-        board the coordinates correspond to and lowercases them
-        """
-        for coord in loc_info:
-            if self._in_row(coord):
-                self._lowercase_in_row(coord)
-            elif self._in_col(coord):
-                self._lowercase_in_col(coord)
-            elif self._in_diag_down(coord):
-                self._lowercase_in_diag_down(coord)
-            elif self._in_diag_up(coord):
-                self._lowercase_in_diag_up(coord)
+        step = self.line_steps[lines]
+        beg = self.line_origins[lines] + offsets[:, None] * step
+        direction = self.line_families[lines]
+        if reverse:
+            beg = beg + (len(word) - 1) * step
+            step = -step
+            direction = direction + len(FAMILIES)
+        beg_rows, beg_cols = self._wrap_cells(beg[:, 0], beg[:, 1],
+                step[:, 0] == 0, step[:, 1] == 0)
+
+        records = np.empty(len(lines), dtype=MATCH_DTYPE)
+        records["word_id"] = word_id
+        records["start_row"] = beg_rows
+        records["start_col"] = beg_cols
+        records["end_row"] = beg_rows + len(word) * step[:, 0]
+        records["end_col"] = beg_cols + len(word) * step[:, 1]
+        records["direction"] = direction
+        return records
+
+    def _wrap_cells(self, rows, cols, row_span, col_span):
+        """
+        Moves cells that lie off the grid back onto it. On a torus rows
+        and columns wrap independently. In raster mode a cell of a row
+        span carries into the next or previous row, a cell of a column
+        span into the next or previous column, and diagonals do not
+        carry at all. Match ends are computed from the moved beginning
+        rather than moved themselves, so the direction and length of the
+        match stay readable
+        """
+        if self.wrap == "torus":
+            return rows % self.rows, cols % self.cols
+        if self.wrap == "raster":
+            carry = np.where(row_span, cols // self.cols, 0)
+            rows, cols = rows + carry, cols - carry * self.cols
+            carry = np.where(col_span, rows // self.rows, 0)
+            rows, cols = rows - carry * self.rows, cols + carry
+        return rows, cols
+
+    def _coords_array(self, records):
+        """
+        Returns the coordinates of MATCH_DTYPE records as an array of
+        shape (matches, 2, 2)
+        """
+        return np.stack([records["start_row"], records["start_col"],
+                         records["end_row"], records["end_col"]], axis=1).reshape(-1, 2, 2)
+
+    def _coords_from_records(self, records):
+        """
+        Returns MATCH_DTYPE records as a list of
+        ((beg_row, beg_col), (end_row, end_col)) tuples
+        """
+        return [((beg_row, beg_col), (end_row, end_col)) for beg_row, beg_col, end_row, end_col
+                in self._coords_array(records).reshape(-1, 4).tolist()]
+
+    def find_words(self, words, batch=None, as_array=False, families=None):
+        """
+        Looks for each word in words, returning a list holding the
+        find_word result for each. With batch set, all words are
+        compiled into one Aho-Corasick automaton and every grid line is
+        scanned through it exactly once. By default batch mode is used
+        for lists of at least BATCH_THRESHOLD words that are also long
+        enough for the grid, see _find_all_records.
+        With as_array set, returns a single structured array of
+        MATCH_DTYPE records for all words, where word_id is the position
+        of the matched word in words. families limits the search as it
+        does for find_word
+        """
+        families = self._check_families(families)
+        records = self._find_all_records(words, families, batch)
+        all_records = np.concatenate(records) if records else np.empty(0, dtype=MATCH_DTYPE)
+        self._update_board(self._coords_array(all_records))
+        if as_array:
+            self.locations = all_records
+        else:
+            self.locations = [self._coords_from_records(r) for r in records]
+        return self.locations
+
+    def _find_all_records(self, words, families, batch):
+        """
+        Returns the MATCH_DTYPE records of each word, numbering them by
+        position in words. Words whose results are cached are not
+        searched again. The rest are searched one by one, or together if
+        batch is set. When batch is None they are searched together if
+        there are at least BATCH_THRESHOLD of them and enough, at
+        BATCH_CHARS_PER_WORD indexed characters each, to cover the lines
+        of the families searched
+        """
+        if self.query_cache_version != self.grid_version:
+            self.query_cache.clear()
+            self.query_cache_version = self.grid_version
+        families = tuple(families)
+        records = []
+        missing = {}
+        for i, w in enumerate(words):
+            cached = self.query_cache.get((w, families))
+            if cached is None:
+                missing.setdefault(w, []).append(i)
+            records.append(cached)
+
+        missing_words = list(missing)
+        if batch is None:
+            batch = len(missing_words) >= BATCH_THRESHOLD and \
+                len(missing_words) * BATCH_CHARS_PER_WORD >= self._indexed_length(families)
+        with phase(self.instrumentation, "search"):
+            if batch:
+                found = self._find_words_batch(missing_words, families)
             else:
-                sys.exit()
-
-    def _lowercase_in_row(self, coord):
-        beg_row, beg_col = coord[0]
-        end_row, end_col = coord[1]
-        length = end_col - beg_col
-        for i in range(length):
-            self.board[beg_row][beg_col] = self.board[beg_row][beg_col].lower()
-            beg_col += 1
-
-    def _lowercase_in_col(self, coord):
-        beg_row, beg_col = coord[0]
-        end_row, end_col = coord[1]
-        length = end_row - beg_row
-
-        for i in range(length):
-            self.board[beg_row][beg_col] = self.board[beg_row][beg_col].lower()
-            beg_row += 1
-
-    def _lowercase_in_diag_down(self, coord):
-        beg_row, beg_col = coord[0]
-        end_row, end_col = coord[1]
-        length = end_row - beg_row
-        for i in range(length):
-            self.board[beg_row][beg_col] = self.board[beg_row][beg_col].lower()
-            beg_row += 1
-            beg_col += 1
-
-    def _lowercase_in_diag_up(self, coord):
-        beg_row, beg_col = coord[0]
-        end_row, end_col = coord[1]
-        length = end_col - beg_col
-        for i in range(length):
-            self.board[beg_row][beg_col] = self.board[beg_row][beg_col].lower()
-            beg_row -= 1
-            beg_col += 1
+                found = [self._find_records(w, 0, families) for w in missing_words]
+        if self.instrumentation is not None:
+            self.instrumentation.count("queries", len(words))
+            self.instrumentation.count("words_searched", len(missing_words))
+            self.instrumentation.count("matches", sum(len(r) for r in found))
+        for w, word_records in zip(missing_words, found):
+            self.query_cache.put((w, families), word_records)
+            for i in missing[w]:
+                records[i] = word_records
+
+        numbered = []
+        for i, word_records in enumerate(records):
+            word_records = word_records.copy()
+            word_records["word_id"] = i
+            numbered.append(word_records)
+        return numbered
+
+    def _indexed_length(self, families):
+        """
+        Returns the number of characters in the lines of the given
+        families
+        """
+        return sum(len(line) for _type in families for line in self.line_arrays[_type])
+
+    def stats(self):
+        """
+        Returns a dict of the "timings" of each phase, in seconds, and
+        of the "counters" collected since construction, including those
+        of every index built. Both are empty unless instrumentation is
+        on. Phases nest: build_index includes the suffix_array,
+        lcp_array and suffix_tree phases of the indexes it builds
+        """
+        if self.instrumentation is None:
+            return {"timings": {}, "counters": {}}
+        return self.instrumentation.stats()
+
+    def cache_info(self):
+        """
+        Returns a dict of the query cache's hit and miss counts, and how
+        many results it holds out of its capacity
+        """
+        return {"hits": self.query_cache.hits, "misses": self.query_cache.misses,
+                "size": len(self.query_cache), "capacity": self.query_cache.capacity}
+
+    def _find_words_batch(self, words, families=FAMILIES):
+        """
+        Finds every word in one pass over the indexed lines, returning
+        the MATCH_DTYPE records of each. Matches come out of the
+        automaton in text order, which is the same order find_word
+        reports them in
+        """
+        patterns = list(dict.fromkeys(words))
+        if self.backwards:
+            patterns = list(dict.fromkeys(patterns + [w[::-1] for w in patterns]))
+        automaton = AhoCorasick(patterns)
+        hits_by_pattern = {}
+        for _type in families:
+            index = self._family_index(_type)
+            # Edits never change line lengths, so the index still locates
+            # each line within the joined text
+            lines = self._family_lines(_type) if self.line_overlays.get(_type) else index.lines
+            starts_by_pattern = {}
+            for start, pattern_id in automaton.search(SEPARATOR.join(lines)):
+                starts_by_pattern.setdefault(patterns[pattern_id], []).append(start)
+            for pattern, starts in starts_by_pattern.items():
+                hits_by_pattern.setdefault(pattern, []).append(self._family_hits(
+                        _type, pattern, *index.line_locations(starts)))
+        find_hits = lambda pattern: self._join_hits(hits_by_pattern.get(pattern, []))
+        return [self._find_records(w, i, find_hits=find_hits) for i, w in enumerate(words)]
+
+    def build_string_from_coords(self, coords):
+        """
+        Given a coords tuple (the begining coords for a string and
+        the end coords for a string), returns the found string
+        """
+        cells = self._cells_from_coords([coords])
+        if cells is None:
+            return ""
+        rows, cols = cells
+        return self._line_text(self.codes[rows, cols])
+
+    def _cells_from_coords(self, loc_info):
+        """
+        Returns a (rows, cols) pair of arrays listing every grid cell
+        spanned by the coords in loc_info, each read from its beginning
+        towards its end in any of the eight directions. End coordinates
+        themselves are not included. Returns None if any coords do not
+        lie on a row, column or diagonal
+        """
+        coords = np.asarray(loc_info, dtype=np.int64).reshape(-1, 2, 2)
+        beg = coords[:, 0]
+        delta = coords[:, 1] - beg
+        d_row, d_col = delta[:, 0], delta[:, 1]
+        straight = (d_row == 0) | (d_col == 0) | (np.abs(d_row) == np.abs(d_col))
+        if not straight.all():
+            return None
+        lengths = np.abs(delta).max(axis=1)
+        owner = np.repeat(np.arange(len(coords)), lengths)
+        k = np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        step = np.sign(delta)[owner]
+        rows = beg[owner, 0] + k * step[:, 0]
+        cols = beg[owner, 1] + k * step[:, 1]
+
+        return self._wrap_cells(rows, cols, d_row[owner] == 0, d_col[owner] == 0)
+
+    def _update_board(self, loc_info):
+        """
+        Given a list of coordinates, marks every cell they span in the
+        matched mask with a single fancy indexing assignment. Raises
+        ValueError if any coordinates are not a straight line
+        """
+        if len(loc_info) == 0:
+            return
+        cells = self._cells_from_coords(loc_info)
+        if cells is None:
+            raise ValueError("Coordinates do not form a straight line: " + str(loc_info))
+        self.matched[cells] = True
@@ -0,0 +1,127 @@
+"""
+Finds words along paths of adjacent cells, as in Boggle. Unlike
+BaseWordSearch, whose words lie along straight lines, a word here may
+turn at every letter, moving to any of the up to eight neighbouring
+cells, so long as no cell is used twice within the word
+"""
+from BaseWordSearch import BaseWordSearch
+
+class BoggleSolver(BaseWordSearch):
+
+    def __init__(self, filename, wrap=None, **kwargs):
+        """
+        Loads the grid as BaseWordSearch does, and takes the same
+        arguments, which only matter for the straight line searches it
+        inherits. With wrap set to "torus", cells on opposite edges of
+        the grid are also adjacent. "raster" wrapping has no meaning for
+        paths, and raises ValueError
+        """
+        if wrap == "raster":
+            raise ValueError("Raster wrapping is not supported for paths")
+        super().__init__(filename, wrap=wrap, **kwargs)
+        self.neighbours = self._make_neighbours()
+
+    def _make_neighbours(self):
+        """
+        Lists the cells adjacent to each cell, numbering cells in
+        row-major order
+        """
+        torus = self.wrap == "torus"
+        neighbours = []
+        for row in range(self.rows):
+            for col in range(self.cols):
+                cells = []
+                for d_row in (-1, 0, 1):
+                    for d_col in (-1, 0, 1):
+                        r, c = row + d_row, col + d_col
+                        if torus:
+                            r, c = r % self.rows, c % self.cols
+                        elif not (0 <= r < self.rows and 0 <= c < self.cols):
+                            continue
+                        cell = r * self.cols + c
+                        if cell != row * self.cols + col and cell not in cells:
+                            cells.append(cell)
+                neighbours.append(tuple(cells))
+        return neighbours
+
+    def _make_trie(self, words):
+        """
+        Builds a trie over the letters of words. Returns the children of
+        each node as a dict from letter to node, the word ending at each
+        node or None, the parent of each node, and the number of words at
+        or below each node. Node 0 is the root, and every node comes after its parent
+        """
+        children, ends, parents = [{}], [None], [0]
+        for word in words:
+            node = 0
+            for char in word:
+                kids = children[node]
+                child = kids.get(char)
+                if child is None:
+                    child = kids[char] = len(children)
+                    children.append({})
+                    ends.append(None)
+                    parents.append(node)
+                node = child
+            if node:
+                ends[node] = word
+        remaining = [int(word is not None) for word in ends]
+        for node in range(len(children) - 1, 0, -1):
+            remaining[parents[node]] += remaining[node]
+        return children, ends, parents, remaining
+
+    def solve(self, words):
+        """
+        Looks for each word in words along some path of adjacent cells
+        that uses no cell twice. Returns a list of (word, path) pairs
+        for the words found, each with the first path found for it as a
+        list of (row, col) cells, in the order they were found. Cells on
+        those paths are marked as matched on the board.
+        The words are compiled into a trie and a depth first search is
+        started from every cell, following only paths that spell the
+        start of some word not found yet, so words found and prefixes
+        which lead nowhere are pruned from then on
+        """
+        children, ends, parents, remaining = self._make_trie(words)
+        letters = self.grid.ravel().tolist()
+        neighbours = self.neighbours
+        cols = self.cols
+        bits = [1 << cell for cell in range(len(letters))]
+        found = []
+        cells = []
+
+        def visit(cell, node, visited):
+            cells.append(cell)
+            # Each word is reported once, and once every word below a
+            # node has been found, no path reaches that node again
+            word = ends[node]
+            if word is not None:
+                ends[node] = None
+                found.append((word, [divmod(c, cols) for c in cells]))
+                n = node
+                while n:
+                    remaining[n] -= 1
+                    n = parents[n]
+                remaining[0] -= 1
+            kids = children[node]
+            for next_cell in neighbours[cell]:
+                child = kids.get(letters[next_cell])
+                if child is not None and remaining[child]:
+                    bit = bits[next_cell]
+                    if not visited & bit:
+                        visit(next_cell, child, visited | bit)
+                        if not remaining[node]:
+                            break
+            cells.pop()
+
+        root = children[0]
+        for cell, letter in enumerate(letters):
+            if not remaining[0]:
+                break
+            child = root.get(letter)
+            if child is not None and remaining[child]:
+                visit(cell, child, bits[cell])
+
+        for word, path in found:
+            self.matched[tuple(zip(*path))] = True
+        return found
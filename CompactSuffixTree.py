@@ -0,0 +1,186 @@
+"""
+Array backed suffix tree. Every node field is stored in a flat typed
+array indexed by node number rather than in a SuffixTreeNode object,
+and children are kept in one compressed table sorted by the first
+character of their edge
+"""
+from array import array
+from bisect import bisect_left
+
+from Instrumentation import phase
+from SuffixTreeEfficient import SuffixTreeEfficient
+
+ROOT = 0
+
+# Per-node and child table arrays making up a built tree
+NODE_ARRAYS = ("parent", "string_depth", "edge_start", "edge_end", "occurs",
+               "sa_lo", "sa_hi", "child_offsets", "child_nodes", "child_chars")
+
+class CompactSuffixTree(SuffixTreeEfficient):
+
+    def __str__(self):
+        return "Text:" + self.text + "\nSuffixArray:" + str(self.suffix_array) + \
+            "\nNodes:" + str(len(self.parent))
+
+    def load_node_arrays(self, arrays):
+        """
+        Installs previously built NODE_ARRAYS, such as ones read back
+        from disk, in place of creating the tree
+        """
+        for name in NODE_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.root = ROOT
+
+    def create_suffix_tree(self):
+        with phase(self.instrumentation, "suffix_tree"):
+            self._make_compact_tree_from_suffix_array(self.text,
+                    self.suffix_array, self.lcp_array)
+            self._make_child_table()
+        self._count_nodes(len(self.text), len(self.parent) - 1 - len(self.text))
+        self.root = ROOT
+
+    def _new_node(self, parent, string_depth, edge_start, edge_end):
+        self.parent.append(parent)
+        self.string_depth.append(string_depth)
+        self.edge_start.append(edge_start)
+        self.edge_end.append(edge_end)
+        self.occurs.append(-1)
+        self.sa_lo.append(0)
+        self.sa_hi.append(0)
+        return len(self.parent) - 1
+
+    def _make_compact_tree_from_suffix_array(self, S, order, lcp_arr):
+        """
+        Same construction as _make_suffix_tree_from_suffix_array. The
+        node broken when a new branch is needed is always the last one
+        stepped up from, and every new node becomes the last child of
+        its parent, so node numbers within a parent follow the order of
+        their edge labels. Each node's [sa_lo, sa_hi) suffix array range
+        is recorded the same way too
+        """
+        self.parent = array('i')
+        self.string_depth = array('i')
+        self.edge_start = array('i')
+        self.edge_end = array('i')
+        self.occurs = array('i')
+        self.sa_lo = array('i')
+        self.sa_hi = array('i')
+        self._new_node(-1, 0, -1, -1)
+
+        depth = self.string_depth
+        lcp_prev = 0
+        curr_node = ROOT
+        for i in range(len(S)):
+            suffix = order[i]
+            while depth[curr_node] > lcp_prev:
+                self.sa_hi[curr_node] = i
+                child = curr_node
+                curr_node = self.parent[curr_node]
+            if depth[curr_node] < lcp_prev:
+                offset = lcp_prev - depth[curr_node]
+                child_start = self.edge_start[child]
+                mid_node = self._new_node(curr_node, lcp_prev,
+                        child_start, child_start + offset - 1)
+                self.parent[child] = mid_node
+                self.sa_lo[mid_node] = self.sa_lo[child]
+                self.edge_start[child] = child_start + offset
+                curr_node = mid_node
+            curr_node = self._new_node(curr_node, len(S) - suffix,
+                    suffix + depth[curr_node], len(S) - 1)
+            self.occurs[curr_node] = suffix
+            self.sa_lo[curr_node] = i
+            if i < len(S)-1:
+                lcp_prev = lcp_arr[i]
+        while curr_node >= 0:
+            self.sa_hi[curr_node] = len(S)
+            curr_node = self.parent[curr_node]
+
+    def _make_child_table(self):
+        """
+        Groups node numbers by parent. The children of node v are
+        child_nodes[child_offsets[v]:child_offsets[v+1]], and
+        child_chars holds the code of the first character of each of
+        their edges, in increasing order. The terminal sorts first
+        whatever its code, so its edges are given code 0
+        """
+        num_nodes = len(self.parent)
+        self.child_offsets = array('i', [0] * (num_nodes + 1))
+        for v in range(1, num_nodes):
+            self.child_offsets[self.parent[v] + 1] += 1
+        for v in range(num_nodes):
+            self.child_offsets[v + 1] += self.child_offsets[v]
+
+        self.child_nodes = array('i', [0] * (num_nodes - 1))
+        self.child_chars = array('I', [0] * (num_nodes - 1))
+        fill = array('i', self.child_offsets)
+        for v in range(1, num_nodes):
+            slot = fill[self.parent[v]]
+            fill[self.parent[v]] += 1
+            self.child_nodes[slot] = v
+            if self.edge_start[v] == len(self.text) - 1:
+                self.child_chars[slot] = 0
+            else:
+                self.child_chars[slot] = ord(self.text[self.edge_start[v]])
+
+    def _children(self, node):
+        return self.child_nodes[self.child_offsets[node]:self.child_offsets[node+1]]
+
+    def _child(self, node, char):
+        """
+        Returns the child of node whose edge begins with char, or -1
+        """
+        lo, hi = self.child_offsets[node], self.child_offsets[node+1]
+        code = ord(char)
+        slot = bisect_left(self.child_chars, code, lo, hi)
+        if slot < hi and self.child_chars[slot] == code:
+            return self.child_nodes[slot]
+        return -1
+
+    def _display_tree_recursive(self, string, curr, space=''):
+        for child in self._children(curr):
+            start = self.edge_start[child]
+            end = self.edge_end[child]
+            string += space + self.text[start:end+1] + "\n"
+            string = self._display_tree_recursive(string, child, space+"\t")
+        return string
+
+    def pattern_interval(self, pattern):
+        """
+        Follows pattern down from the root one edge at a time, picking
+        each edge by its first character. If pattern is matched, returns
+        the suffix array range of the node reached, otherwise an empty
+        range
+        """
+        if self.root is None or pattern == "":
+            return SuffixTreeEfficient.pattern_interval(self, pattern)
+
+        curr_node = ROOT
+        curr_char_pos = 0
+        while curr_char_pos < len(pattern):
+            child = self._child(curr_node, pattern[curr_char_pos])
+            if child < 0:
+                return self._count_search(curr_char_pos + 1, 0, 0)
+            start = self.edge_start[child]
+            length = min(self.edge_end[child] - start + 1,
+                    len(pattern) - curr_char_pos)
+            if not self.text.startswith(
+                    pattern[curr_char_pos:curr_char_pos+length], start):
+                return self._count_search(curr_char_pos + length, 0, 0)
+            curr_char_pos += length
+            curr_node = child
+
+        return self._count_search(curr_char_pos, self.sa_lo[curr_node], self.sa_hi[curr_node])
+
+    def _edges(self, node):
+        for child in self._children(node):
+            yield child, self.edge_start[child], self.edge_end[child]
+
+    def _interval(self, node):
+        return self.sa_lo[node], self.sa_hi[node]
+
+    def _explore_leaves(self, node, locations):
+        """
+        Appends where the suffix at each leaf below node occurs in the
+        string to locations, in suffix array order
+        """
+        locations.extend(self.suffix_array[self.sa_lo[node]:self.sa_hi[node]])
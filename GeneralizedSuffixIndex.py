@@ -0,0 +1,180 @@
+"""
+A single suffix index over many strings at once. The strings are
+joined with a separator character and indexed by one suffix tree, and
+a line offset table maps each match back to the string it came from
+"""
+from bisect import bisect_right
+
+import numpy as np
+
+from CompactSuffixTree import CompactSuffixTree, NODE_ARRAYS
+from SuffixArrayEfficient import SEPARATOR, TERMINAL
+from SuffixTreeEfficient import SuffixTreeEfficient
+
+KINDS = ("tree", "compact", "array")
+
+class GeneralizedSuffixIndex(object):
+
+    def __init__(self, lines, kind="tree", instrumentation=None):
+        """
+        Lines must not contain the separator character. Since patterns
+        never contain it either, a match can never span two lines.
+        kind is "tree" to search a suffix tree, "compact" to search an
+        array backed suffix tree, or "array" to search the suffix array
+        directly and skip building a tree. instrumentation is handed to
+        the tree, see SuffixTreeEfficient
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown index kind: " + str(kind))
+        self.kind = kind
+        self.lines = list(lines)
+        if any(SEPARATOR in line for line in self.lines):
+            raise ValueError("Lines may not contain the separator " + SEPARATOR)
+        self.offsets = self._compute_line_offsets(self.lines)
+        text = SEPARATOR.join(self.lines)
+        if kind == "compact":
+            self.tree = CompactSuffixTree(text, instrumentation=instrumentation)
+        else:
+            self.tree = SuffixTreeEfficient(text, instrumentation=instrumentation)
+        if kind != "array":
+            self.tree.create_suffix_tree()
+
+    def __str__(self):
+        return "Generalized index over " + str(len(self.lines)) + " lines"
+
+    def to_arrays(self, node_arrays=False):
+        """
+        Returns the text and every array making up the index as a dict
+        of NumPy arrays, from which from_arrays can restore it. With
+        node_arrays set, a "tree" index also includes the NODE_ARRAYS of
+        the same tree in compact form, so that from_arrays can restore it
+        without rebuilding any nodes
+        """
+        tree = self.tree
+        dtype = np.int32 if len(tree.text) < 2**31 else np.int64
+        arrays = {
+            "text": np.frombuffer(tree.text.encode("utf-8"), dtype=np.uint8),
+            "offsets": np.array(self.offsets, dtype=np.int64),
+            "suffix_array": np.asarray(tree.suffix_array, dtype=dtype),
+            "lcp_array": np.asarray(tree.lcp_array, dtype=dtype),
+        }
+        if self.kind == "array":
+            if tree.llcp_array is None:
+                tree._build_lcp_tables()
+            arrays["llcp_array"] = np.asarray(tree.llcp_array, dtype=dtype)
+            arrays["rlcp_array"] = np.asarray(tree.rlcp_array, dtype=dtype)
+        elif self.kind == "compact":
+            for name in NODE_ARRAYS:
+                arrays[name] = np.asarray(getattr(tree, name))
+        elif node_arrays:
+            compact = CompactSuffixTree.from_arrays(tree.text, tree.suffix_array,
+                                                    tree.lcp_array)
+            compact.create_suffix_tree()
+            for name in NODE_ARRAYS:
+                arrays[name] = np.asarray(getattr(compact, name))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, kind="tree", instrumentation=None):
+        """
+        Restores an index saved by to_arrays. The "compact" and "array"
+        kinds search the given arrays directly, so memory mapped arrays
+        stay on disk until touched. So does the "tree" kind when saved
+        with node_arrays, searching them as a CompactSuffixTree, which
+        gives the same results. Otherwise it rebuilds its nodes from the
+        suffix and LCP arrays, which takes linear time
+        """
+        index = cls.__new__(cls)
+        index.kind = kind
+        text = bytes(arrays["text"]).decode("utf-8")
+        index.lines = text[:-1].split(SEPARATOR)
+        index.offsets = arrays["offsets"].tolist()
+        suffix_array, lcp_array = arrays["suffix_array"], arrays["lcp_array"]
+        if kind == "compact" or kind == "tree" and all(n in arrays for n in NODE_ARRAYS):
+            index.tree = CompactSuffixTree.from_arrays(text, suffix_array, lcp_array,
+                                                       instrumentation)
+            index.tree.load_node_arrays(arrays)
+        elif kind == "tree":
+            index.tree = SuffixTreeEfficient.from_arrays(text,
+                    suffix_array.tolist(), lcp_array.tolist(), instrumentation)
+            index.tree.create_suffix_tree()
+        else:
+            index.tree = SuffixTreeEfficient.from_arrays(text, suffix_array, lcp_array,
+                                                         instrumentation)
+            index.tree.llcp_array = arrays["llcp_array"]
+            index.tree.rlcp_array = arrays["rlcp_array"]
+        return index
+
+    def _compute_line_offsets(self, lines):
+        """
+        Returns a list where offsets[i] is the index in the joined text
+        at which line i begins
+        """
+        offsets = []
+        start = 0
+        for line in lines:
+            offsets.append(start)
+            start += len(line) + 1
+        return offsets
+
+    def line_location(self, position):
+        """
+        Given an index into the joined text, returns the (line, offset)
+        pair it falls on
+        """
+        line = bisect_right(self.offsets, position) - 1
+        return line, position - self.offsets[line]
+
+    def line_locations(self, positions):
+        """
+        Same as line_location for an array of indices into the joined
+        text, returning a pair of (lines, offsets) arrays
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        offsets = np.asarray(self.offsets, dtype=np.int64)
+        lines = np.searchsorted(offsets, positions, side="right") - 1
+        return lines, positions - offsets[lines]
+
+    def find_positions(self, pattern):
+        """
+        Same as find_pattern, but returns the matches as a pair of
+        (lines, offsets) arrays rather than a list of tuples
+        """
+        if SEPARATOR in pattern or TERMINAL in pattern:
+            return self.line_locations([])
+        positions = np.asarray(self.tree.find_pattern(pattern), dtype=np.int64)
+        return self.line_locations(np.sort(positions))
+
+    def count_pattern(self, pattern):
+        """
+        Returns how many times pattern occurs across all lines, without
+        listing where. Patterns holding the separator or the terminal,
+        which only occur between or after the lines, count 0
+        """
+        if SEPARATOR in pattern or TERMINAL in pattern:
+            return 0
+        return self.tree.count_pattern(pattern)
+
+    def find_positions_approx(self, pattern, k):
+        """
+        Returns (lines, offsets, mismatches) arrays of every place where
+        pattern occurs with at most k characters replaced, ordered by
+        line and then by offset. A match never spans two lines
+        """
+        if SEPARATOR in pattern or TERMINAL in pattern:
+            return self.line_locations([]) + (np.empty(0, dtype=np.int64),)
+        found = sorted(self.tree.find_pattern_approx(pattern, k, SEPARATOR))
+        positions = np.array([p for p, _ in found], dtype=np.int64)
+        mismatches = np.array([mm for _, mm in found], dtype=np.int64)
+        return self.line_locations(positions) + (mismatches,)
+
+    def find_pattern(self, pattern):
+        """
+        Returns a list of (line, offset) pairs where pattern occurs,
+        ordered by line and then by offset within the line. Patterns
+        holding the separator or the terminal occur nowhere
+        """
+        if SEPARATOR in pattern or TERMINAL in pattern:
+            return []
+        positions = sorted(map(int, self.tree.find_pattern(pattern)))
+        return [self.line_location(p) for p in positions]
@@ -0,0 +1,96 @@
+"""
+Versioned on-disk storage for built indexes. A file holds a fixed
+header, a JSON description of its contents and the raw bytes of each
+array, aligned so that loading is a single memory map of the file
+rather than a rebuild
+"""
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"WSINDEX\0"
+FORMAT_VERSION = 3
+ALIGNMENT = 64
+HEADER = struct.Struct("<8sII")
+
+def cache_key(grid, **config):
+    """
+    Returns a hex digest identifying an index built over grid with the
+    given settings
+    """
+    digest = hashlib.sha256()
+    digest.update(str(FORMAT_VERSION).encode())
+    digest.update(json.dumps(config, sort_keys=True).encode())
+    digest.update(str(grid.shape).encode())
+    digest.update(grid.dtype.str.encode())
+    digest.update(np.ascontiguousarray(grid).tobytes())
+    return digest.hexdigest()
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + ".wsidx")
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def save_arrays(path, meta, arrays):
+    """
+    Writes meta, which must be JSON serializable, and a dict of NumPy
+    arrays to path. The file is written under a temporary name and
+    moved into place, so readers never see a partial file
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    layout = {}
+    size = 0
+    for name, arr in arrays.items():
+        size = _align(size)
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": size}
+        size += arr.nbytes
+    header = json.dumps({"meta": meta, "arrays": layout}).encode()
+    data_start = _align(HEADER.size + len(header))
+
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(header)))
+        out.write(header)
+        for name, arr in arrays.items():
+            out.seek(data_start + layout[name]["offset"])
+            out.write(arr.tobytes())
+        out.truncate(data_start + size)
+    os.replace(tmp_path, path)
+
+def load_arrays(path):
+    """
+    Returns the (meta, arrays) pair stored at path. The arrays are read
+    only views into a memory map of the file. Raises ValueError if the
+    file is not an index file of the current version
+    """
+    with open(path, "rb") as infile:
+        fixed = infile.read(HEADER.size)
+        if len(fixed) < HEADER.size:
+            raise ValueError("Index file " + path + " is too short")
+        magic, version, header_len = HEADER.unpack(fixed)
+        if magic != MAGIC:
+            raise ValueError("Not an index file: " + path)
+        if version != FORMAT_VERSION:
+            raise ValueError("Index file " + path + " has version " + str(version) +
+                             ", expected " + str(FORMAT_VERSION))
+        header = json.loads(infile.read(header_len).decode())
+    data_start = _align(HEADER.size + header_len)
+
+    buf = None
+    if os.path.getsize(path) > data_start:
+        buf = np.memmap(path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+            continue
+        start = data_start + info["offset"]
+        arrays[name] = buf[start:start + nbytes].view(dtype).reshape(shape)
+    return header["meta"], arrays
@@ -0,0 +1,69 @@
+"""
+Optional timers and counters for index construction and search.
+Classes that support it take an Instrumentation, or None to switch it
+off, in which case the only cost is a check for None
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+_NO_PHASE = nullcontext()
+
+def phase(instrumentation, name):
+    """
+    Returns a context manager timing its body as the named phase of
+    instrumentation, or one that does nothing if instrumentation is None
+    """
+    if instrumentation is None:
+        return _NO_PHASE
+    return instrumentation.phase(name)
+
+class Instrumentation(object):
+
+    def __init__(self, callback=None):
+        """
+        callback, if given, is called as callback(kind, name, value)
+        each time a phase finishes, with kind "time" and value the
+        seconds it took, and each time a counter is incremented, with
+        kind "count" and value the increment
+        """
+        self.callback = callback
+        self.timings = {}
+        self.counters = {}
+
+    def __str__(self):
+        lines = ["%s: %.6fs" % item for item in sorted(self.timings.items())]
+        lines += ["%s: %d" % item for item in sorted(self.counters.items())]
+        return "\n".join(lines)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Adds the time taken by the body of the with statement to the
+        total for the named phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if self.callback is not None:
+            self.callback("time", name, seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback is not None:
+            self.callback("count", name, n)
+
+    def stats(self):
+        """
+        Returns a dict holding copies of the per-phase timings, in
+        seconds, and of the counters
+        """
+        return {"timings": dict(self.timings), "counters": dict(self.counters)}
+
+    def reset(self):
+        self.timings.clear()
+        self.counters.clear()
@@ -0,0 +1,56 @@
+"""
+Bounded mapping which, once full, evicts the entry that was least
+recently looked up or stored. Counts lookups that hit and miss
+"""
+from collections import OrderedDict
+
+class LRUCache(object):
+
+    def __init__(self, capacity):
+        """
+        A capacity of 0 stores nothing, so every lookup misses
+        """
+        if capacity < 0:
+            raise ValueError("Cache capacity must not be negative: " + str(capacity))
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return "LRU cache holding " + str(len(self.entries)) + " of " + \
+            str(self.capacity) + " entries, " + str(self.hits) + " hits, " + \
+            str(self.misses) + " misses"
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for key, marking it most recently used,
+        or default if there is none
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        """
+        Stores value for key, evicting the least recently used entries
+        beyond capacity
+        """
+        if self.capacity == 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every entry. The hit and miss counts are kept
+        """
+        self.entries.clear()
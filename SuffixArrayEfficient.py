@@ -1,23 +1,51 @@
 # python3
 import sys
 
+import numpy as np
+
 """
 Contains source code for efficiently creating a Suffix Array
 for a long string. For a string S, this builds a Suffix Array
 in time O( |S| log(s) ) using O(|S|) memory
 """
 
+# Character used to join several strings into a single text. It sorts
+# after every letter of the default alphabet
+SEPARATOR = "|"
+
+# Character appended to the end of every text. It sorts before every
+# other character
+TERMINAL = "$"
+
+# Texts at least this long are sorted by the NumPy engine when the engine
+# is left on "auto"; below it the array setup costs more than it saves and
+# SA-IS is used instead (see benchmark.py)
+NUMPY_THRESHOLD = 128
+
+ENGINES = ("auto", "doubling", "numpy", "sais")
+
 class SuffixArrayEfficient(object):
 
-    def __init__(self, text, terminal="$", custom_alpha=False):
+    def __init__(self, text, terminal=TERMINAL, custom_alpha=False, engine="auto"):
         """
         Alphabet must be in order such that the smallest value
         character is furthest left in the string and values
-        continue increasing as we progress right
+        continue increasing as we progress right.
+        engine selects how the suffix array is built: "doubling" for
+        the pure Python prefix doubling, "numpy" for the vectorized
+        version of it, "sais" for linear time induced sorting, or
+        "auto" to pick by text length
         """
+        if engine not in ENGINES:
+            raise ValueError("Unknown suffix array engine: " + str(engine))
+        self.engine = engine
         self.text = text + terminal
         if not custom_alpha:
-            self.alpha = terminal + "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+            self.alpha = terminal + "ABCDEFGHIJKLMNOPQRSTUVWXYZ" + SEPARATOR
+            # Characters beyond the default alphabet sort by code point
+            extra = set(self.text) - set(self.alpha)
+            if extra:
+                self.alpha = terminal + ''.join(sorted(set(self.alpha[1:]) | extra))
         else:
             self.alpha = self._get_custom_alpha()
 
@@ -39,6 +67,19 @@ class SuffixArrayEfficient(object):
         in text where the i-th lexicographically smallest
         suffix of text starts.
         """
+        engine = self.engine
+        if engine == "auto":
+            engine = "numpy" if len(self.text) >= NUMPY_THRESHOLD else "sais"
+        if engine == "numpy":
+            return self._build_suffix_array_numpy()
+        if engine == "sais":
+            return self._build_suffix_array_sais()
+        return self._build_suffix_array_doubling()
+
+    def _build_suffix_array_doubling(self):
+        """
+        Prefix doubling over cyclic shifts, one element at a time
+        """
         order = self._sort_characters()
         classes = self._compute_character_classes(order)
         L = 1
@@ -63,7 +104,7 @@ class SuffixArrayEfficient(object):
         - If we look at the sorted array of our original text, ["B", "C", "D"]
         this is true
         """
-        order = [0] * len(self.alpha)
+        order = [0] * len(self.text)
         count = {letter: 0 for letter in self.alpha}
 
         # Store the count of each unique letter in the text
@@ -164,3 +205,142 @@ class SuffixArrayEfficient(object):
                 new_class[cur] = new_class[prev]
 
         return new_class
+
+    def _text_ranks(self):
+        """
+        Returns the text as a NumPy array holding the position of each
+        character within the alphabet
+        """
+        codes = np.frombuffer(self.text.encode("utf-32-le"), dtype=np.uint32)
+        alpha_codes = np.array([ord(c) for c in self.alpha], dtype=np.uint32)
+        lookup = np.full(max(codes.max(), alpha_codes.max()) + 1, -1, dtype=np.int64)
+        lookup[alpha_codes] = np.arange(len(alpha_codes))
+        ranks = lookup[codes]
+        if (ranks < 0).any():
+            raise ValueError("Text contains characters outside the alphabet")
+        return ranks
+
+    def _build_suffix_array_numpy(self):
+        """
+        Prefix doubling with order and classes held in NumPy arrays.
+        Each round sorts the (class, class shifted by L) pairs with a
+        single lexsort and derives the new classes from where adjacent
+        pairs differ. Stops early once every class is distinct
+        """
+        classes = self._text_ranks()
+        n = len(classes)
+        order = np.argsort(classes, kind="stable")
+        L = 1
+        while L < n:
+            shifted = np.roll(classes, -L)
+            order = np.lexsort((shifted, classes))
+            first, second = classes[order], shifted[order]
+            changed = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+            new_classes = np.empty(n, dtype=np.int64)
+            new_classes[order[0]] = 0
+            new_classes[order[1:]] = np.cumsum(changed)
+            classes = new_classes
+            if classes[order[-1]] == n - 1:
+                break
+            L = 2 * L
+        return order.tolist()
+
+    def _build_suffix_array_sais(self):
+        """
+        Induced sorting (SA-IS) over the alphabet ranks of the text.
+        Runs in O(|S|) time. Relies on the terminal being the smallest
+        character and occurring only at the end of the text
+        """
+        return _sais(self._text_ranks().tolist(), len(self.alpha))
+
+def _sais(s, k):
+    """
+    Returns the suffix array of s, a list of integers in range(k) whose
+    last element is its unique smallest value
+    """
+    n = len(s)
+    if n == 1:
+        return [0]
+
+    # Classify each suffix as S-type (True) or L-type (False)
+    stype = [False] * n
+    stype[n-1] = True
+    for i in range(n-2, -1, -1):
+        stype[i] = s[i] < s[i+1] or (s[i] == s[i+1] and stype[i+1])
+    is_lms = [False] * n
+    for i in range(1, n):
+        is_lms[i] = stype[i] and not stype[i-1]
+    lms = [i for i in range(1, n) if is_lms[i]]
+
+    counts = [0] * k
+    for c in s:
+        counts[c] += 1
+
+    def bucket_heads():
+        heads, total = [0] * k, 0
+        for c in range(k):
+            heads[c] = total
+            total += counts[c]
+        return heads
+
+    def bucket_tails():
+        tails, total = [0] * k, 0
+        for c in range(k):
+            total += counts[c]
+            tails[c] = total
+        return tails
+
+    def induce(lms_order):
+        sa = [-1] * n
+        tails = bucket_tails()
+        for i in reversed(lms_order):
+            tails[s[i]] -= 1
+            sa[tails[s[i]]] = i
+        heads = bucket_heads()
+        for i in range(n):
+            j = sa[i] - 1
+            if j >= 0 and not stype[j]:
+                sa[heads[s[j]]] = j
+                heads[s[j]] += 1
+        tails = bucket_tails()
+        for i in range(n-1, -1, -1):
+            j = sa[i] - 1
+            if j >= 0 and stype[j]:
+                tails[s[j]] -= 1
+                sa[tails[s[j]]] = j
+        return sa
+
+    def lms_substrings_equal(a, b):
+        if a == n - 1 or b == n - 1:
+            return False
+        j = 0
+        while True:
+            a_end = j > 0 and is_lms[a+j]
+            b_end = j > 0 and is_lms[b+j]
+            if a_end and b_end:
+                return True
+            if a_end != b_end or s[a+j] != s[b+j] or stype[a+j] != stype[b+j]:
+                return False
+            j += 1
+
+    # Sort the LMS substrings, then name them by rank
+    sa = induce(lms)
+    names = [-1] * n
+    name, prev = -1, -1
+    for i in sa:
+        if not is_lms[i]:
+            continue
+        if prev < 0 or not lms_substrings_equal(prev, i):
+            name += 1
+        names[i] = name
+        prev = i
+
+    # Sort the LMS suffixes, recursing while their names are not unique
+    reduced = [names[i] for i in lms]
+    if name + 1 < len(lms):
+        reduced_sa = _sais(reduced, name + 1)
+    else:
+        reduced_sa = [0] * len(lms)
+        for i, rank in enumerate(reduced):
+            reduced_sa[rank] = i
+    return induce([lms[i] for i in reduced_sa])
@@ -2,20 +2,53 @@
 Efficient construction of a SuffixTree for a string
 Builds a suffix tree from suffix array in linear time
 Can build a suffix tree from scratch in S*log(S) time
+Patterns can also be found on the suffix array alone, without building
+the tree, using LCP accelerated binary search (Manber and Myers)
 """
 
-from SuffixArrayEfficient import SuffixArrayEfficient
+from Instrumentation import phase
+from SuffixArrayEfficient import SuffixArrayEfficient, TERMINAL
 from SuffixTreeNode import SuffixTreeNode
 
 class SuffixTreeEfficient(object):
-    def __init__(self, text, terminal="$"):
+    def __init__(self, text, terminal=TERMINAL, engine="auto", instrumentation=None):
+        """
+        instrumentation, if given, is an Instrumentation collecting the
+        time spent in each phase of construction along with counts of
+        nodes created, edges broken, patterns searched, characters
+        compared and leaves enumerated
+        """
+        self.instrumentation = instrumentation
         self.text = text + terminal
-        self.suffix_array = SuffixArrayEfficient(text).build_suffix_array()
-        self.lcp_array = self._compute_lcp_array()
+        with phase(instrumentation, "suffix_array"):
+            self.suffix_array = SuffixArrayEfficient(text, terminal,
+                    engine=engine).build_suffix_array()
+        with phase(instrumentation, "lcp_array"):
+            self.lcp_array = self._compute_lcp_array()
+        self.root = None
+        self.llcp_array = None
+        self.rlcp_array = None
 
     def __str__(self):
         return "Text:" + self.text + "\nSuffixArray:" + str(self.suffix_array)
 
+    @classmethod
+    def from_arrays(cls, text, suffix_array, lcp_array, instrumentation=None):
+        """
+        Creates a tree over text, which already ends with its terminal,
+        from a previously computed suffix array and LCP array. The tree
+        itself still has to be created before it is searched as one
+        """
+        tree = cls.__new__(cls)
+        tree.instrumentation = instrumentation
+        tree.text = text
+        tree.suffix_array = suffix_array
+        tree.lcp_array = lcp_array
+        tree.root = None
+        tree.llcp_array = None
+        tree.rlcp_array = None
+        return tree
+
     def _invert_suffix_array(self, order):
         pos = [0] * len(order)
         for i in range(len(order)):
@@ -74,20 +107,31 @@ class SuffixTreeEfficient(object):
                     start,
                     start + offset - 1
                     )
-        mid_node.children[mid_char] = node.children[start_char]
-        node.children[start_char].parent = mid_node
-        node.children[start_char].edge_start = start + offset
+        child = node.children[start_char]
+        mid_node.children[mid_char] = child
+        mid_node.sa_lo = child.sa_lo
+        child.parent = mid_node
+        child.edge_start = child.edge_start + offset
         node.children[start_char] = mid_node
         return mid_node
 
     def _make_suffix_tree_from_suffix_array(self, S, order, lcp_arr):
+        """
+        Builds the tree by adding suffixes in suffix array order. Each
+        node is annotated with the [sa_lo, sa_hi) range of the suffix
+        array its leaves cover: sa_lo is set when the node is created
+        and sa_hi once the walk steps back up past it
+        """
         root = SuffixTreeNode(None, 0, -1, -1)
+        root.sa_lo = 0
+        edges_broken = 0
         lcp_prev = 0
         curr_node = root
         for i in range(len(S)):
             suffix = order[i]
             #print("suffix:", suffix)
             while curr_node.string_depth > lcp_prev:
+                curr_node.sa_hi = i
                 curr_node = curr_node.parent
             if curr_node.string_depth == lcp_prev:
                 curr_node = self._new_leaf(curr_node, S, suffix)
@@ -96,17 +140,42 @@ class SuffixTreeEfficient(object):
                 edge_start = order[i-1] + curr_node.string_depth
                 offset = lcp_prev - curr_node.string_depth
                 mid_node = self._break_edge(curr_node, S, edge_start, offset)
+                edges_broken += 1
                 #mid_node.occurs = suffix
                 curr_node = self._new_leaf(mid_node, S, suffix)
                 curr_node.occurs=suffix
+            curr_node.sa_lo = i
             if i < len(S)-1:
                 lcp_prev = lcp_arr[i]
+        while curr_node is not None:
+            curr_node.sa_hi = len(S)
+            curr_node = curr_node.parent
+        self._count_nodes(len(S), edges_broken)
         return root
 
+    def _count_nodes(self, leaves, edges_broken):
+        """
+        Every suffix adds a leaf and every broken edge an inner node,
+        besides the root
+        """
+        if self.instrumentation is not None:
+            self.instrumentation.count("nodes_created", 1 + leaves + edges_broken)
+            self.instrumentation.count("edges_broken", edges_broken)
+
     def create_suffix_tree(self):
-        lcp_array = self._compute_lcp_array()
-        self.root = self._make_suffix_tree_from_suffix_array(self.text, \
-                self.suffix_array, lcp_array)
+        # The LCP array was computed along with the suffix array
+        with phase(self.instrumentation, "suffix_tree"):
+            self.root = self._make_suffix_tree_from_suffix_array(self.text, \
+                    self.suffix_array, self.lcp_array)
+
+    def stats(self):
+        """
+        Returns the timings and counters collected by instrumentation
+        so far, or empty ones if there is none
+        """
+        if self.instrumentation is None:
+            return {"timings": {}, "counters": {}}
+        return self.instrumentation.stats()
 
     def display_tree(self):
         """
@@ -137,52 +206,260 @@ class SuffixTreeEfficient(object):
         """
         Traverses the suffix tree to find if a given pattern
         can be matched. If so, returns a list of indices where it
-        occurs
+        occurs. If the tree has not been created, the pattern is
+        searched for in the suffix array instead
+        """
+        lo, hi = self.pattern_interval(pattern)
+        if self.instrumentation is not None:
+            self.instrumentation.count("leaves_enumerated", hi - lo)
+        return self.suffix_array[lo:hi]
+
+    def count_pattern(self, pattern):
+        """
+        Returns how many times pattern occurs, read off the size of its
+        suffix array range without listing where
+        """
+        lo, hi = self.pattern_interval(pattern)
+        return hi - lo
+
+    def pattern_interval(self, pattern):
         """
+        Returns the [lo, hi) range of the suffix array holding every
+        suffix that starts with pattern, found by traversing the tree,
+        or if it has not been created, by searching the suffix array.
+        The range is empty if the pattern does not occur
+        """
+        if pattern == "":
+            return self._count_search(0, 0, 0)
+        if self.root is None:
+            lo, hi = self.find_interval(pattern)
+            return self._count_search(None, lo, hi)
+
         curr_node = self.root
         curr_char_pos = 0
-        updated = True
-        while curr_char_pos < len(pattern) and updated:
-            updated = False
-            for child in curr_node.children.keys():
-                child_node = curr_node.children[child]
-                edge_label = self.text[child_node.edge_start:child_node.edge_end+1]
-                edge_label_len = child_node.edge_end - child_node.edge_start + 1
-
-                # Check if pattern contains the full edge label
-                if pattern[curr_char_pos:curr_char_pos+edge_label_len] == edge_label:
-                    curr_char_pos += edge_label_len
-                    curr_node = child_node
-                    updated = True
-                    break
-
-                # Check if edge label contains the pattern
-                elif edge_label.startswith(pattern[curr_char_pos:]):
-                    curr_char_pos = len(pattern)
-                    curr_node = child_node
-                    updated = True
-                    break
-
-            # We have completed the pattern, now return where the pattern
-            # occurs in the original text
-            if curr_char_pos == len(pattern):
-                # Not a leaf node, all children of node contain pattern
-                if curr_node.occurs == None:
-                    locations = []
-                    self._explore_leaves(curr_node, locations)
+        while curr_char_pos < len(pattern):
+            child_node = curr_node.children.get(pattern[curr_char_pos])
+            if child_node is None:
+                return self._count_search(curr_char_pos + 1, 0, 0)
+            edge_label_len = child_node.edge_end - child_node.edge_start + 1
+            length = min(edge_label_len, len(pattern) - curr_char_pos)
+
+            # Compare the rest of the pattern against the edge in place
+            if not self.text.startswith(
+                    pattern[curr_char_pos:curr_char_pos+length], child_node.edge_start):
+                return self._count_search(curr_char_pos + length, 0, 0)
+            curr_char_pos += length
+            curr_node = child_node
+
+        # We have completed the pattern. Every suffix below the node
+        # contains it, and they are contiguous in the suffix array
+        return self._count_search(curr_char_pos, curr_node.sa_lo, curr_node.sa_hi)
+
+    def _count_search(self, chars_compared, lo, hi):
+        """
+        Records a finished search and passes its range through.
+        chars_compared is None when the binary search already counted
+        its own comparisons
+        """
+        if self.instrumentation is not None:
+            self.instrumentation.count("patterns_searched")
+            if chars_compared is not None:
+                self.instrumentation.count("chars_compared", chars_compared)
+        return lo, hi
+
+    def find_pattern_approx(self, pattern, k, forbidden=""):
+        """
+        Returns a list of (index, mismatches) pairs for every place
+        where pattern occurs with at most k of its characters replaced.
+        No character of pattern is ever replaced by the terminal or by
+        a character in forbidden. The tree is walked depth first
+        carrying the number of mismatches so far, so a prefix shared by
+        many suffixes is compared once, and a branch is abandoned as
+        soon as it would need more than k
+        """
+        if k < 0:
+            raise ValueError("Number of mismatches must not be negative: " + str(k))
+        if pattern == "":
+            return []
+        if self.root is None:
+            return self._find_approx_in_suffix_array(pattern, k, forbidden)
+
+        text, last = self.text, len(self.text) - 1
+        found = []
+        stack = [(self.root, 0, 0)]
+        while stack:
+            node, depth, mismatches = stack.pop()
+            for child, start, end in self._edges(node):
+                i, pos, mm = depth, start, mismatches
+                while i < len(pattern) and pos <= end:
+                    char = text[pos]
+                    if char != pattern[i]:
+                        if mm == k or pos == last or char in forbidden:
+                            break
+                        mm += 1
+                    i += 1
+                    pos += 1
                 else:
-                    locations = [curr_node.occurs]
-                return locations
-        return []
+                    if i < len(pattern):
+                        stack.append((child, i, mm))
+                        continue
+                    lo, hi = self._interval(child)
+                    found.extend((suffix, mm) for suffix in self.suffix_array[lo:hi])
+        return found
+
+    def _find_approx_in_suffix_array(self, pattern, k, forbidden):
+        """
+        Same walk as find_pattern_approx, over the suffix array alone.
+        The suffixes sharing a prefix form a range of the suffix array,
+        which splits into one range for each character that can follow
+        the prefix, each found by binary search
+        """
+        text, order, last = self.text, self.suffix_array, len(self.text) - 1
+        found = []
+        stack = [(0, len(order), 0, 0)]
+        while stack:
+            lo, hi, depth, mm = stack.pop()
+            if depth == len(pattern):
+                found.extend((suffix, mm) for suffix in order[lo:hi])
+                continue
+            while lo < hi:
+                pos = order[lo] + depth
+                char = text[pos]
+                run_end = self._char_run_end(lo, hi, depth, char)
+                if char == pattern[depth]:
+                    # Nothing follows the terminal, so a suffix reaching
+                    # it matches only if the pattern ends there too
+                    if pos != last or depth + 1 == len(pattern):
+                        stack.append((lo, run_end, depth + 1, mm))
+                elif mm < k and pos != last and char not in forbidden:
+                    stack.append((lo, run_end, depth + 1, mm + 1))
+                lo = run_end
+        return found
+
+    def _char_run_end(self, lo, hi, depth, char):
+        """
+        Within a range of suffixes sharing their first depth characters,
+        returns the end of the run starting at lo whose next character
+        is char. The terminal sorts before every other character
+        """
+        text, order, last = self.text, self.suffix_array, len(self.text) - 1
+        if order[lo] + depth == last:
+            return lo + 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if text[order[mid] + depth] == char:
+                lo = mid
+            else:
+                hi = mid
+        return hi
+
+    def _edges(self, node):
+        """
+        Yields (child, edge_start, edge_end) for each child of node
+        """
+        for child in node.children.values():
+            yield child, child.edge_start, child.edge_end
+
+    def _interval(self, node):
+        return node.sa_lo, node.sa_hi
 
     def _explore_leaves(self, node, locations):
         """
-        Explores a down thru to the leaves from a given node,
-        appending where the suffix at the leaf occurs in the
-        string to locations
+        Appends where the suffix at each leaf below node occurs in the
+        string to locations. The leaves below a node cover a contiguous
+        range of the suffix array, so no traversal is needed
+        """
+        locations.extend(self.suffix_array[node.sa_lo:node.sa_hi])
+
+    def _build_lcp_tables(self):
+        """
+        Binary search over the suffix array always probes the same
+        midpoints. For the midpoint M of each (L, R) search range,
+        stores the lcp of suffixes L and M in llcp_array and of M and R
+        in rlcp_array. Ranges extend from -1 to len(suffix_array), whose
+        virtual suffixes share no prefix with anything
+        """
+        n = len(self.suffix_array)
+        self.llcp_array = [0] * n
+        self.rlcp_array = [0] * n
+
+        def fill(L, R):
+            if R - L == 1:
+                if L < 0 or R >= n:
+                    return 0
+                return self.lcp_array[L]
+            M = (L + R) // 2
+            self.llcp_array[M] = fill(L, M)
+            self.rlcp_array[M] = fill(M, R)
+            return min(self.llcp_array[M], self.rlcp_array[M])
+
+        fill(-1, n)
+
+    def _compare_suffix(self, pattern, suffix, k):
+        """
+        Compares pattern against the suffix starting at suffix, given
+        that their first k characters are already known to match.
+        Returns the length of their common prefix and -1, 0 or 1 if the
+        suffix is smaller than, starts with, or is larger than pattern
         """
-        for child in node.children.keys():
-            if node.children[child].occurs != None:
-                locations.append(node.children[child].occurs)
+        text = self.text
+        while k < len(pattern) and suffix + k < len(text) and \
+                text[suffix+k] == pattern[k]:
+            k += 1
+        if k == len(pattern):
+            return k, 0
+        # The terminal sorts before every other character
+        if suffix + k >= len(text) - 1 or text[suffix+k] < pattern[k]:
+            return k, -1
+        return k, 1
+
+    def _find_bound(self, pattern, upper):
+        """
+        Binary searches the suffix array for the first suffix that does
+        not sort before pattern, or with upper set, the first suffix
+        that sorts after every suffix starting with pattern. l and r
+        track how much of pattern the suffixes at L and R match, so
+        characters are only compared past what is already known
+        """
+        L, R = -1, len(self.suffix_array)
+        l = r = 0
+        compared = 0
+        while R - L > 1:
+            M = (L + R) // 2
+            if l >= r:
+                if self.llcp_array[M] > l:
+                    L = M
+                    continue
+                if self.llcp_array[M] < l:
+                    R, r = M, self.llcp_array[M]
+                    continue
+                known = l
+            else:
+                if self.rlcp_array[M] > r:
+                    R = M
+                    continue
+                if self.rlcp_array[M] < r:
+                    L, l = M, self.rlcp_array[M]
+                    continue
+                known = r
+            k, cmp = self._compare_suffix(pattern, self.suffix_array[M], known)
+            compared += k - known + (k < len(pattern))
+            if cmp < 0 or (upper and cmp == 0):
+                L, l = M, k
             else:
-                self._explore_leaves(node.children[child], locations)
+                R, r = M, k
+        if self.instrumentation is not None:
+            self.instrumentation.count("chars_compared", compared)
+        return R
+
+    def find_interval(self, pattern):
+        """
+        Returns the [lo, hi) range of the suffix array holding every
+        suffix that starts with pattern. The range is empty if the
+        pattern does not occur
+        """
+        if self.llcp_array is None:
+            self._build_lcp_tables()
+        lo = self._find_bound(pattern, False)
+        hi = self._find_bound(pattern, True)
+        return lo, hi
@@ -10,6 +10,10 @@ class SuffixTreeNode(object):
         self.edge_start = edge_start
         self.edge_end = edge_end
         self.occurs = None
+        # Range [sa_lo, sa_hi) of the suffix array covered by the leaves
+        # below this node
+        self.sa_lo = None
+        self.sa_hi = None
 
     def __str__(self):
         return "Depth: " + str(self.string_depth) + \
@@ -0,0 +1,67 @@
+"""
+Blocking client for WordSearchServer. Sends one request at a time over
+a single connection and returns results in the form BaseWordSearch
+returns them
+"""
+import json
+import socket
+
+def to_coords(matches):
+    """
+    Converts the matches of one word from JSON lists back into
+    ((beg_row, beg_col), (end_row, end_col)) tuples
+    """
+    return [(tuple(beg), tuple(end)) for beg, end in matches]
+
+class WordSearchClient(object):
+
+    def __init__(self, address, timeout=None):
+        """
+        address is the path of the server's Unix socket, or a
+        (host, port) pair to connect over TCP
+        """
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.stream = self.sock.makefile("rb")
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def request(self, op, grid, **params):
+        """
+        Sends a request and returns its result. Raises ValueError with
+        the server's message if the request failed, and ConnectionError
+        if the server closed the connection
+        """
+        self.next_id += 1
+        message = dict(params, id=self.next_id, op=op, grid=grid)
+        self.sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def find_word(self, grid, word, families=None):
+        return to_coords(self.request("find_word", grid, word=word, families=families))
+
+    def find_words(self, grid, words, families=None):
+        return [to_coords(matches) for matches in
+                self.request("find_words", grid, words=list(words), families=families)]
+
+    def contains(self, grid, word, families=None):
+        return self.request("contains", grid, word=word, families=families)
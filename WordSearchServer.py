@@ -0,0 +1,247 @@
+"""
+Long-lived server which loads grids once and answers word searches over
+them, so that each query no longer pays for reading the grid and
+building its indexes. Listens on a Unix socket or a localhost TCP port.
+
+Requests and responses are newline-delimited JSON objects, one per
+line. A request names an op, one of OPERATIONS, and the grid to search,
+along with the op's arguments, and may carry an id which is echoed back:
+    {"id": 1, "op": "find_word", "grid": "grid1", "word": "QWE"}
+    {"id": 2, "op": "find_words", "grid": "grid1", "words": ["QW", "AS"]}
+    {"id": 3, "op": "contains", "grid": "grid1", "word": "QWE",
+     "families": ["rows"]}
+Each response holds either the result, in the form BaseWordSearch
+returns it with tuples as lists, or an error message:
+    {"id": 1, "result": [[[0, 0], [0, 2]]]}
+    {"id": 4, "error": "Unknown grid: grid9"}
+Requests on one connection are answered in order. Searches run in a
+pool of worker processes, each holding its own indexed copy of every
+grid, so connections are served in parallel.
+
+Usage: python WordSearchServer.py GRID [NAME=GRID ...]
+                                  (--unix PATH | --port PORT) [--workers N]
+                                  [--index tree] [--backwards] [--wrap torus]
+                                  [--cache-dir DIR]
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from BaseWordSearch import BaseWordSearch, WRAPS
+from GeneralizedSuffixIndex import KINDS
+
+OPERATIONS = ("find_word", "find_words", "contains")
+
+# Longest request line accepted, which bounds the size of find_words lists
+LINE_LIMIT = 1 << 24
+
+# Grids loaded into each worker process, by name
+_searches = {}
+
+def _load_grids(grids, options):
+    """
+    Loads and indexes every grid when a worker process starts
+    """
+    for name, filename in grids.items():
+        search = BaseWordSearch(filename, **options)
+        search.warm()
+        _searches[name] = search
+
+def _ready():
+    return len(_searches)
+
+def _run(op, grid, params):
+    """
+    Answers a checked request in a worker process
+    """
+    search = _searches[grid]
+    families = params.get("families")
+    if op == "find_word":
+        return search.find_word(params["word"], families=families)
+    if op == "find_words":
+        return search.find_words(params["words"], families=families)
+    return search.contains(params["word"], families=families)
+
+def encode(message):
+    """
+    Returns message as one line of JSON
+    """
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+def grid_name(filename):
+    """
+    Returns the name a grid file is served under when none is given,
+    its file name without the extension
+    """
+    return os.path.splitext(os.path.basename(filename))[0]
+
+class WordSearchServer(object):
+
+    def __init__(self, grids, workers=None, **options):
+        """
+        grids maps the name each grid is served under to its file.
+        Every worker process, of which there are workers or else one per
+        CPU, loads each grid into a BaseWordSearch constructed with
+        options and builds all of its indexes. Each file is also loaded
+        once here, so that a bad grid or option raises ValueError
+        straight away rather than in the workers. With a cache_dir
+        option, that first load builds and saves the indexes, which the
+        workers then memory map instead of building their own
+        """
+        self.grids = dict(grids)
+        if not self.grids:
+            raise ValueError("No grids to serve")
+        for filename in self.grids.values():
+            BaseWordSearch(filename, **options)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_load_grids,
+                                            initargs=(self.grids, options))
+        self.server = None
+
+    async def start(self, path=None, host="127.0.0.1", port=0):
+        """
+        Starts every worker, waiting until each has indexed the grids,
+        then listens on the Unix socket at path if given, or else on
+        host and port. Port 0 picks a free port. Returns the
+        asyncio.Server
+        """
+        loop = asyncio.get_running_loop()
+        # Tasks submitted together each start a worker of their own
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _ready)
+                               for i in range(self.workers)))
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._serve_client, path,
+                                                          limit=LINE_LIMIT)
+        else:
+            self.server = await asyncio.start_server(self._serve_client, host, port,
+                                                     limit=LINE_LIMIT)
+        return self.server
+
+    def address(self):
+        """
+        Returns the Unix socket path or (host, port) being listened on
+        """
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown()
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The rest of an overlong line cannot be skipped, so
+                    # the connection is closed after saying why
+                    writer.write(encode({"id": None, "error": "Request line too long"}))
+                    break
+                if not line:
+                    break
+                writer.write(encode(await self.respond(line)))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, line):
+        """
+        Returns the response to one request line. Every failure is
+        reported as an error response rather than raised
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+            request_id = request.get("id")
+            op, grid, params = self._check_request(request)
+        except ValueError as e:
+            return {"id": request_id, "error": str(e)}
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.executor, _run, op, grid, params)
+        except ValueError as e:
+            return {"id": request_id, "error": str(e)}
+        except Exception as e:
+            # Anything else, such as a bug or a worker dying with a
+            # BrokenProcessPool, is still answered so the client never
+            # waits on a closed connection
+            return {"id": request_id, "error": type(e).__name__ + ": " + str(e)}
+        return {"id": request_id, "result": result}
+
+    def _check_request(self, request):
+        """
+        Returns the op, grid and arguments of a request, raising
+        ValueError if any are missing or malformed
+        """
+        op = request.get("op")
+        if op not in OPERATIONS:
+            raise ValueError("Unknown op: " + str(op))
+        grid = request.get("grid")
+        if not isinstance(grid, str) or grid not in self.grids:
+            raise ValueError("Unknown grid: " + str(grid))
+        if op == "find_words":
+            words = request.get("words")
+            if not isinstance(words, list) or not all(isinstance(w, str) for w in words):
+                raise ValueError("find_words needs words as a list of strings")
+            params = {"words": words}
+        else:
+            word = request.get("word")
+            if not isinstance(word, str):
+                raise ValueError(op + " needs word as a string")
+            params = {"word": word}
+        families = request.get("families")
+        if families is not None:
+            if not isinstance(families, list) or not all(isinstance(f, str) for f in families):
+                raise ValueError("families must be a list of strings")
+            params["families"] = families
+        return op, grid, params
+
+async def serve(grids, path=None, host="127.0.0.1", port=0, workers=None, **options):
+    """
+    Runs a WordSearchServer until cancelled
+    """
+    server = WordSearchServer(grids, workers, **options)
+    try:
+        await server.start(path, host, port)
+        print("Serving", ", ".join(sorted(server.grids)), "on", server.address(),
+              "with", server.workers, "workers", flush=True)
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Word search query server")
+    parser.add_argument("grids", nargs="+", metavar="GRID",
+                        help="grid file, served under its name without the "
+                        "extension, or NAME=FILE")
+    parser.add_argument("--unix", help="listen on this Unix socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--index", choices=KINDS, default="tree")
+    parser.add_argument("--backwards", action="store_true")
+    parser.add_argument("--wrap", choices=[w for w in WRAPS if w is not None])
+    parser.add_argument("--cache-dir", help="share built indexes between runs and workers")
+    args = parser.parse_args()
+
+    grids = {}
+    for spec in args.grids:
+        name, sep, filename = spec.rpartition("=")
+        grids[name if sep else grid_name(filename)] = filename
+    try:
+        asyncio.run(serve(grids, args.unix, args.host, args.port, args.workers,
+                          index=args.index, backwards=args.backwards,
+                          wrap=args.wrap, cache_dir=args.cache_dir))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""
+Benchmarks for index construction and search. Builds seeded random
+grids, joins all of their lines the same way BaseWordSearch does, and
+either times each suffix array engine on the resulting text or measures
+how many bytes per text character each suffix tree representation takes.
+
+With --suite, runs every benchmark: suffix array and LCP construction,
+tree construction, find_word latency percentiles, find_words throughput,
+peak memory while building a BaseWordSearch and BoggleSolver path
+search. --json writes the results to a file, and --compare checks them
+against a baseline written the same way, exiting with status 1 if any
+got worse by more than --tolerance.
+
+With --batch-crossover, measures the grid size at which searching
+find_words lists in one Aho-Corasick pass stops paying off.
+
+Usage: python benchmark.py [--sizes 20 50 100] [--repeats 3] [--memory]
+       python benchmark.py --batch-crossover [--queries 200]
+       python benchmark.py --suite [--alphabet ABC] [--json out.json]
+                           [--compare baseline.json] [--tolerance 0.25]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from BaseWordSearch import BaseWordSearch
+from BoggleSolver import BoggleSolver
+from CompactSuffixTree import CompactSuffixTree
+from GeneralizedSuffixIndex import KINDS
+from SuffixArrayEfficient import SuffixArrayEfficient, SEPARATOR, ENGINES
+from SuffixTreeEfficient import SuffixTreeEfficient
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+# Metrics for which a larger value is an improvement. For every other
+# metric, such as seconds or bytes, smaller is better
+HIGHER_IS_BETTER = ("words_per_second",)
+
+def random_grid(rows, cols, alphabet=ALPHABET, seed=0):
+    """
+    Returns a rows x cols NumPy array of letters drawn from alphabet
+    """
+    rng = random.Random(seed)
+    letters = [rng.choice(alphabet) for i in range(rows * cols)]
+    return np.array(letters).reshape(rows, cols)
+
+def grid_text(grid):
+    """
+    Joins every row, column and diagonal of grid into a single text
+    """
+    lines = [''.join(row) for row in grid]
+    lines += [''.join(col) for col in grid.T]
+    flipped = np.flipud(grid)
+    for k in range(-len(grid) + 1, len(grid[0])):
+        lines.append(''.join(np.diagonal(grid, k)))
+        lines.append(''.join(np.diagonal(flipped, k)))
+    return SEPARATOR.join(lines)
+
+def time_call(func, repeats):
+    """
+    Returns the best wall clock time of repeats calls to func
+    """
+    best = float("inf")
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_suffix_array_engines(sizes, repeats=3, engines=None, seed=0):
+    """
+    Times build_suffix_array for each engine on the text of an n x n
+    grid for each n in sizes. Returns a list of result dicts
+    """
+    engines = engines or [e for e in ENGINES if e != "auto"]
+    results = []
+    for n in sizes:
+        text = grid_text(random_grid(n, n, seed=seed))
+        for engine in engines:
+            sa = SuffixArrayEfficient(text, engine=engine)
+            seconds = time_call(sa.build_suffix_array, repeats)
+            results.append({"grid": n, "chars": len(text) + 1,
+                            "engine": engine, "seconds": seconds})
+    return results
+
+def tree_bytes(tree_class, text):
+    """
+    Returns the number of bytes allocated by create_suffix_tree for a
+    tree of tree_class over text
+    """
+    tree = tree_class(text)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree.create_suffix_tree()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+def bench_tree_memory(sizes, seed=0):
+    """
+    Measures the bytes per text character taken by SuffixTreeEfficient's
+    node objects and by CompactSuffixTree's arrays for an n x n grid for
+    each n in sizes. Returns a list of result dicts
+    """
+    results = []
+    for n in sizes:
+        text = grid_text(random_grid(n, n, seed=seed))
+        for tree_class in (SuffixTreeEfficient, CompactSuffixTree):
+            size = tree_bytes(tree_class, text)
+            results.append({"grid": n, "chars": len(text) + 1,
+                            "tree": tree_class.__name__, "bytes": size,
+                            "bytes_per_char": size / (len(text) + 1)})
+    return results
+
+def write_grid(grid, path):
+    """
+    Writes grid to path in the CSV format BaseWordSearch reads
+    """
+    with open(path, "w", encoding="utf-8") as out:
+        out.write("\n".join(",".join(row) for row in grid) + "\n")
+
+def random_words(grid, count, rng, max_len=8):
+    """
+    Returns count words, half read along random rows, columns and
+    diagonals of grid so that they are found, and half random strings
+    over the grid's letters which mostly are not
+    """
+    rows, cols = grid.shape
+    letters = sorted(set(grid.ravel()))
+    steps = [(0, 1), (1, 0), (1, 1), (-1, 1)]
+    words = []
+    while len(words) < count:
+        length = rng.randint(2, max_len)
+        if len(words) % 2:
+            words.append("".join(rng.choice(letters) for i in range(length)))
+            continue
+        d_row, d_col = rng.choice(steps)
+        row, col = rng.randrange(rows), rng.randrange(cols)
+        word = ""
+        while 0 <= row < rows and 0 <= col < cols and len(word) < length:
+            word += grid[row, col]
+            row, col = row + d_row, col + d_col
+        words.append(word)
+    return words
+
+def bench_batch_crossover(sizes, queries=200, repeats=3, seed=0):
+    """
+    Times find_words over queries words on an n x n grid for each n in
+    sizes, both one word at a time and in one Aho-Corasick pass.
+    Reports the seconds per word of the first, the seconds per indexed
+    character of the second, and their ratio: the number of indexed
+    characters per word beyond which batch mode stops paying off, from
+    which BATCH_CHARS_PER_WORD is set. Returns a list of result dicts
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            grid = random_grid(n, n, seed=seed)
+            path = os.path.join(tmp, "grid%d.txt" % n)
+            write_grid(grid, path)
+            words = random_words(grid, queries, random.Random(seed))
+            ws = BaseWordSearch(path, cache_size=0)
+            ws.warm()
+            chars = int(ws.line_lengths.sum())
+            per_word = time_call(lambda: ws.find_words(words, batch=False), repeats) / len(words)
+            per_char = time_call(lambda: ws.find_words(words, batch=True), repeats) / chars
+            results.append({"grid": n, "chars": chars, "per_word": per_word,
+                            "per_char": per_char, "chars_per_word": per_word / per_char})
+    return results
+
+def result(benchmark, metric, value, **params):
+    """
+    Returns a result record. Records of the same benchmark, metric and
+    params are compared against each other
+    """
+    record = {"benchmark": benchmark}
+    record.update(params)
+    record["metric"] = metric
+    record["value"] = value
+    return record
+
+def run_suite(sizes, repeats=3, alphabet=ALPHABET, seed=0, queries=200):
+    """
+    Runs every benchmark on a seeded random n x n grid over alphabet for
+    each n in sizes. Returns a list of result records
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            rng = random.Random(seed)
+            grid = random_grid(n, n, alphabet, seed)
+            text = grid_text(grid)
+            path = os.path.join(tmp, "grid%d.txt" % n)
+            write_grid(grid, path)
+            words = random_words(grid, queries, rng)
+
+            sa = SuffixArrayEfficient(text)
+            results.append(result("build_suffix_array", "seconds",
+                                   time_call(sa.build_suffix_array, repeats), grid=n))
+            tree = SuffixTreeEfficient(text)
+            results.append(result("compute_lcp_array", "seconds",
+                                  time_call(tree._compute_lcp_array, repeats), grid=n))
+            for tree_class in (SuffixTreeEfficient, CompactSuffixTree):
+                tree = tree_class(text)
+                results.append(result("create_suffix_tree", "seconds",
+                                      time_call(tree.create_suffix_tree, repeats),
+                                      grid=n, tree=tree_class.__name__))
+
+            for kind in KINDS:
+                build = lambda: BaseWordSearch(path, index=kind, cache_size=0).warm()
+                results.append(result("build_word_search", "seconds",
+                                      time_call(build, repeats), grid=n, index=kind))
+                results.append(result("build_word_search", "peak_bytes",
+                                      peak_memory(build), grid=n, index=kind))
+
+                ws = BaseWordSearch(path, index=kind, cache_size=0)
+                ws.warm()
+                latencies = []
+                for word in words:
+                    start = time.perf_counter()
+                    ws.find_word(word)
+                    latencies.append(time.perf_counter() - start)
+                for q in (50, 90, 99):
+                    results.append(result("find_word", "p%d_seconds" % q,
+                                          float(np.percentile(latencies, q)),
+                                          grid=n, index=kind))
+                for batch in (False, True):
+                    seconds = time_call(lambda: ws.find_words(words, batch=batch), repeats)
+                    results.append(result("find_words", "words_per_second",
+                                          len(words) / seconds,
+                                          grid=n, index=kind, batch=batch))
+
+            solve = lambda: BoggleSolver(path).solve(words)
+            results.append(result("boggle_solve", "seconds",
+                                  time_call(solve, repeats), grid=n))
+    return results
+
+def peak_memory(func):
+    """
+    Returns the peak number of bytes allocated while func runs
+    """
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def result_key(record):
+    return tuple(sorted((k, v) for k, v in record.items() if k != "value"))
+
+def compare_results(results, baseline, tolerance=0.25):
+    """
+    Matches each result with the baseline result of the same benchmark,
+    metric and params. Returns a list of (record, baseline value,
+    relative change) for those that got worse by more than tolerance,
+    where relative change is positive when worse
+    """
+    baseline_values = {result_key(r): r["value"] for r in baseline}
+    regressions = []
+    for record in results:
+        before = baseline_values.get(result_key(record))
+        if not before:
+            continue
+        change = (record["value"] - before) / before
+        if record["metric"] in HIGHER_IS_BETTER:
+            change = -change
+        if change > tolerance:
+            regressions.append((record, before, change))
+    return regressions
+
+def describe(record):
+    params = ["%s=%s" % (k, v) for k, v in record.items()
+              if k not in ("benchmark", "metric", "value")]
+    return "%s %s [%s]" % (record["benchmark"], record["metric"], " ".join(params))
+
+def main():
+    parser = argparse.ArgumentParser(description="Index construction benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 20, 50, 100])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--engines", nargs="+", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory", action="store_true",
+                        help="measure suffix tree memory instead of build time")
+    parser.add_argument("--batch-crossover", action="store_true",
+                        help="measure where find_words batch mode pays off")
+    parser.add_argument("--suite", action="store_true",
+                        help="run every construction and search benchmark")
+    parser.add_argument("--alphabet", default=ALPHABET)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", help="write suite results to this file")
+    parser.add_argument("--compare", help="baseline suite results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative change beyond which a result has regressed")
+    args = parser.parse_args()
+
+    if args.suite:
+        results = run_suite(args.sizes, args.repeats, args.alphabet, args.seed, args.queries)
+        for record in results:
+            print("%-60s %14.6g" % (describe(record), record["value"]))
+        if args.json:
+            with open(args.json, "w") as out:
+                json.dump({"seed": args.seed, "alphabet": args.alphabet,
+                           "results": results}, out, indent=1)
+        if args.compare:
+            with open(args.compare) as infile:
+                baseline = json.load(infile)["results"]
+            regressions = compare_results(results, baseline, args.tolerance)
+            for record, before, change in regressions:
+                print("REGRESSION %s: %.6g -> %.6g (%+.0f%%)" % (describe(record),
+                      before, record["value"], 100 * change))
+            if regressions:
+                sys.exit(1)
+            print("No regressions beyond %.0f%%" % (100 * args.tolerance))
+        return
+
+    if args.batch_crossover:
+        print("%6s %10s %12s %12s %14s" % ("grid", "chars", "s/word", "s/char",
+                                            "chars/word"))
+        for r in bench_batch_crossover(args.sizes, args.queries, args.repeats, args.seed):
+            print("%6d %10d %12.3g %12.3g %14.0f" % (r["grid"], r["chars"], r["per_word"],
+                                                     r["per_char"], r["chars_per_word"]))
+        return
+
+    if args.memory:
+        print("%6s %10s %20s %12s %10s" % ("grid", "chars", "tree", "bytes", "per char"))
+        for r in bench_tree_memory(args.sizes, args.seed):
+            print("%6d %10d %20s %12d %10.1f" % (r["grid"], r["chars"], r["tree"],
+                                                 r["bytes"], r["bytes_per_char"]))
+        return
+
+    print("%6s %10s %10s %10s" % ("grid", "chars", "engine", "seconds"))
+    for r in bench_suffix_array_engines(args.sizes, args.repeats, args.engines, args.seed):
+        print("%6d %10d %10s %10.4f" % (r["grid"], r["chars"], r["engine"], r["seconds"]))
+
+if __name__ == '__main__':
+    main()
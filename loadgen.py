@@ -0,0 +1,107 @@
+"""
+Load generator for WordSearchServer. Opens several connections, each
+sending one request at a time for words drawn from the grid the same
+way benchmark.py draws them, and reports the requests served per second
+and the latency percentiles over every request.
+
+Usage: python loadgen.py GRID (--unix PATH | --port PORT) [--name NAME]
+                         [--connections 8] [--requests 2000]
+                         [--op find_word] [--batch 50] [--seed 0]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from BaseWordSearch import BaseWordSearch
+from WordSearchServer import OPERATIONS, LINE_LIMIT, grid_name
+from benchmark import random_words
+
+async def run_connection(address, requests, latencies, errors):
+    """
+    Sends each request line in turn over one connection, recording how
+    long each took to answer
+    """
+    if isinstance(address, str):
+        reader, writer = await asyncio.open_unix_connection(address, limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(*address, limit=LINE_LIMIT)
+    try:
+        for line in requests:
+            start = time.perf_counter()
+            writer.write(line)
+            await writer.drain()
+            response = await reader.readline()
+            latencies.append(time.perf_counter() - start)
+            if not response:
+                raise ConnectionError("Server closed the connection")
+            if "error" in json.loads(response):
+                errors.append(response)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def generate_load(address, requests, connections):
+    """
+    Spreads request lines evenly over connections sending at the same
+    time. Returns the wall clock time taken, the latency of each request
+    and the responses that were errors
+    """
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_connection(address, requests[i::connections],
+                                          latencies, errors)
+                           for i in range(connections)))
+    return time.perf_counter() - start, latencies, errors
+
+def make_requests(grid, name, op, count, batch, seed=0):
+    """
+    Returns count request lines for op over random words from grid
+    """
+    rng = random.Random(seed)
+    words = random_words(grid, count * (batch if op == "find_words" else 1), rng)
+    requests = []
+    for i in range(count):
+        request = {"id": i, "op": op, "grid": name}
+        if op == "find_words":
+            request["words"] = words[i * batch:(i + 1) * batch]
+        else:
+            request["word"] = words[i]
+        requests.append(json.dumps(request).encode("utf-8") + b"\n")
+    return requests
+
+def main():
+    parser = argparse.ArgumentParser(description="Word search server load generator")
+    parser.add_argument("grid", help="grid file the server was started with")
+    parser.add_argument("--name", help="name the grid is served under")
+    parser.add_argument("--unix", help="connect to this Unix socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--op", choices=OPERATIONS, default="find_word")
+    parser.add_argument("--batch", type=int, default=50,
+                        help="words in each find_words request")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    grid = BaseWordSearch(args.grid).grid
+    requests = make_requests(grid, args.name or grid_name(args.grid), args.op,
+                             args.requests, args.batch, args.seed)
+    address = args.unix if args.unix is not None else (args.host, args.port)
+    seconds, latencies, errors = asyncio.run(generate_load(address, requests,
+                                                           args.connections))
+
+    print("%d requests over %d connections in %.3fs: %.1f requests/s" %
+          (len(latencies), args.connections, seconds, len(latencies) / seconds))
+    for q in (50, 90, 99, 99.9):
+        print("p%-5g %10.3f ms" % (q, 1000 * np.percentile(latencies, q)))
+    print("max    %10.3f ms" % (1000 * max(latencies)))
+    if errors:
+        print("%d errors, the first: %s" % (len(errors), errors[0].decode("utf-8").strip()))
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,21 @@
+import asyncio
+import os
 import random
+import tempfile
+from math import gcd
 
 import numpy as np
 
-from BaseWordSearch import BaseWordSearch
+from AhoCorasick import AhoCorasick
+import IndexCache
+from BaseWordSearch import BaseWordSearch, DIRECTIONS, MATCH_DTYPE, ORDERS
+from BoggleSolver import BoggleSolver
+from CompactSuffixTree import CompactSuffixTree
+from Instrumentation import Instrumentation
+from SuffixArrayEfficient import SuffixArrayEfficient
+from SuffixTreeEfficient import SuffixTreeEfficient
+from WordSearchClient import WordSearchClient
+from WordSearchServer import WordSearchServer
 
 def test_load_csv():
     print("Testing loading csv...", end='')
@@ -17,6 +30,37 @@ def test_load_csv():
 
     print("Done")
 
+def test_load_csv_bytes():
+    print("Testing loading csv into character codes...", end='')
+    ws = BaseWordSearch("grids/grid1.txt")
+    assert ws.codes.dtype == np.uint8
+    np.testing.assert_array_equal(ws.codes, [[81, 87, 69, 82], [65, 83, 68, 70]])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "grid.txt")
+        with open(path, "w", newline="") as f:
+            f.write("Q, W ,E\r\n\r\nA,S,D\r\n")
+        np.testing.assert_array_equal(BaseWordSearch(path).grid,
+            [['Q', 'W', 'E'], ['A', 'S', 'D']])
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\u0416,B\nC,a\n")
+        for index in ("tree", "compact", "array"):
+            ws = BaseWordSearch(path, index=index)
+            assert ws.codes.dtype == np.uint16
+            assert ws.find_word("\u0416B") == [((0, 0), (0, 2))]
+            assert ws.find_word("Ca") == [((1, 0), (1, 2))]
+
+        for bad in ["Q,W\nA\n", "Q,W,\nA,S,\n", "QW\nAS\n", "\n\n", "A,$,B\n", "A,|,B\n"]:
+            with open(path, "w") as f:
+                f.write(bad)
+            try:
+                BaseWordSearch(path)
+                assert False, "accepted " + repr(bad)
+            except ValueError:
+                pass
+    print("Done")
+
 def test_str_():
     # NOTE: Sorry, too lazy to break these assertion lines up
     print("Testing str representations of grid... ", end='')
@@ -87,6 +131,702 @@ def test_find_word():
 
     print("Done")
 
+def test_find_word_repeated_letters():
+    print("Testing find word on repeated letters... ", end='')
+    ws = BaseWordSearch("grids/grid4.txt")
+    words = gen_random_strings_from_letters("ABC")
+    for word in words:
+        expected = brute_force_find(ws.grid, word)
+        assert sorted(ws.find_word(word)) == sorted(expected)
+    assert ws.find_word("AAAA") == [((1, 1), (1, 5))]
+    assert ws.find_word("CC") == [((3, 0), (3, 2)), ((2, 1), (4, 1)), \
+        ((3, 0), (1, 2))]
+
+    print("Done")
+
+def test_find_word_backwards():
+    print("Testing find word backwards...", end='')
+    ws = BaseWordSearch("grids/grid1.txt", backwards=True)
+    assert ws.find_word("REWQ") == [((0, 3), (0, -1))]
+    assert ws.find_word("AQ") == [((1, 0), (-1, 0))]
+    assert ws.find_word("SQ") == [((1, 1), (-1, -1))]
+    assert ws.find_word("WA") == [((0, 1), (2, -1))]
+    assert ws.find_word("QW") == [((0, 0), (0, 2))]
+
+    steps = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc]
+    ws = BaseWordSearch("grids/grid4.txt", backwards=True)
+    batch_ws = BaseWordSearch("grids/grid4.txt", backwards=True)
+    words = gen_random_strings_from_letters("ABC")
+    results = ws.find_words(words, batch=False)
+    assert batch_ws.find_words(words, batch=True) == results
+    for word, found in zip(words, results):
+        assert sorted(found) == sorted(brute_force_find(ws.grid, word, steps))
+        for coords in found:
+            assert ws.build_string_from_coords(coords) == word
+    print("Done")
+
+def test_find_word_torus():
+    print("Testing find word on a torus...", end='')
+    ws = BaseWordSearch("grids/grid1.txt", wrap="torus")
+    assert ws.find_word("RQ") == [((0, 3), (0, 5))]
+    assert ws.find_word("FQ") == [((1, 3), (3, 5)), ((1, 3), (-1, 5))]
+    assert ws.build_string_from_coords(((1, 3), (3, 5))) == "FQ"
+    assert ws.find_word("QWERQ") == []
+
+    steps = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc]
+    for backwards in (False, True):
+        ws = BaseWordSearch("grids/grid4.txt", backwards=backwards, wrap="torus")
+        words = gen_random_strings_from_letters("ABC")
+        results = ws.find_words(words, batch=False)
+        batch_ws = BaseWordSearch("grids/grid4.txt", backwards=backwards, wrap="torus")
+        assert batch_ws.find_words(words, batch=True) == results
+        for word, found in zip(words, results):
+            expected = brute_force_torus_find(ws.grid, word,
+                    steps if backwards else [(0, 1), (1, 0), (1, 1), (-1, 1)])
+            assert sorted(found) == sorted(expected)
+            for coords in found:
+                assert ws.build_string_from_coords(coords) == word
+    print("Done")
+
+def test_find_word_raster():
+    print("Testing find word across rows and columns...", end='')
+    ws = BaseWordSearch("grids/grid1.txt", wrap="raster")
+    assert ws.find_word("ERAS") == [((0, 2), (0, 6))]
+    assert ws.find_word("AW") == [((1, 0), (3, 0)), ((1, 0), (-1, 2))]
+    assert ws.build_string_from_coords(((0, 2), (0, 6))) == "ERAS"
+    assert ws.build_string_from_coords(((1, 0), (3, 0))) == "AW"
+
+    for backwards in (False, True):
+        ws = BaseWordSearch("grids/grid4.txt", backwards=backwards, wrap="raster")
+        words = gen_random_strings_from_letters("ABC")
+        results = ws.find_words(words, batch=False)
+        batch_ws = BaseWordSearch("grids/grid4.txt", backwards=backwards, wrap="raster")
+        assert batch_ws.find_words(words, batch=True) == results
+        diag_steps = [(1, 1), (-1, 1)]
+        if backwards:
+            diag_steps += [(-1, -1), (1, -1)]
+        for word, found in zip(words, results):
+            expected = brute_force_raster_find(ws.grid, word, backwards)
+            expected += brute_force_find(ws.grid, word, diag_steps)
+            assert sorted(found) == sorted(expected)
+            for coords in found:
+                assert ws.build_string_from_coords(coords) == word
+    print("Done")
+
+def brute_force_raster_find(grid, word, backwards):
+    found = []
+    rows, cols = len(grid), len(grid[0])
+    row_major = ''.join(grid.flatten())
+    col_major = ''.join(grid.T.flatten())
+    for p in range(rows * cols):
+        r, c = divmod(p, cols)
+        if row_major.startswith(word, p) and word:
+            found.append(((r, c), (r, c + len(word))))
+        if backwards and word and row_major[::-1].startswith(word, rows*cols - 1 - p):
+            found.append(((r, c), (r, c - len(word))))
+        c, r = divmod(p, rows)
+        if col_major.startswith(word, p) and word:
+            found.append(((r, c), (r + len(word), c)))
+        if backwards and word and col_major[::-1].startswith(word, rows*cols - 1 - p):
+            found.append(((r, c), (r - len(word), c)))
+    return found
+
+def brute_force_torus_find(grid, word, steps):
+    found = []
+    rows, cols = len(grid), len(grid[0])
+    for dr, dc in steps:
+        cycle = cols if dr == 0 else rows if dc == 0 else rows * cols // gcd(rows, cols)
+        if word == "" or len(word) > cycle:
+            continue
+        for r in range(rows):
+            for c in range(cols):
+                letters = [grid[(r + dr*k) % rows][(c + dc*k) % cols] for k in range(len(word))]
+                if ''.join(letters) == word:
+                    found.append(((r, c), (r + dr*len(word), c + dc*len(word))))
+    return found
+
+def brute_force_find(grid, word, steps=((0, 1), (1, 0), (1, 1), (-1, 1))):
+    """
+    Reads every straight line out of the grid cell by cell and returns
+    the coordinates of each match of word
+    """
+    found = []
+    if word == "":
+        return found
+    rows, cols = len(grid), len(grid[0])
+    for dr, dc in steps:
+        for r in range(rows):
+            for c in range(cols):
+                end_r, end_c = r + dr * (len(word) - 1), c + dc * (len(word) - 1)
+                if not (0 <= end_r < rows and 0 <= end_c < cols):
+                    continue
+                letters = [grid[r + dr*k][c + dc*k] for k in range(len(word))]
+                if ''.join(letters) == word:
+                    found.append(((r, c), (r + dr*len(word), c + dc*len(word))))
+    return found
+
+def test_suffix_array_engines():
+    print("Testing suffix array engines...", end='')
+    texts = ["", "A", "ABABAA", "AAAAAAAA", "QWER|ASDF|QWER"]
+    texts += [gen_random_string("ABC|" * 50 + " ") for i in range(50)]
+    for text in texts:
+        expected = sorted(range(len(text) + 1), key=lambda i: text[i:] + "$")
+        for engine in ("doubling", "numpy", "sais"):
+            sa = SuffixArrayEfficient(text, engine=engine).build_suffix_array()
+            assert sa == expected
+    print("Done")
+
+def test_find_interval():
+    print("Testing suffix array interval search...", end='')
+    for i in range(50):
+        text = gen_random_string("AB|" * 20 + " ")
+        st = SuffixTreeEfficient(text)
+        for pattern in ["A", "B", "AB", "BA", "AAB", "BBA", "ABAB", "C"]:
+            lo, hi = st.find_interval(pattern)
+            expected = [j for j in range(len(text)) if text.startswith(pattern, j)]
+            assert sorted(st.suffix_array[lo:hi]) == expected
+            assert sorted(st.find_pattern(pattern)) == expected
+
+    tree_ws = BaseWordSearch("grids/grid4.txt")
+    array_ws = BaseWordSearch("grids/grid4.txt", index="array")
+    for word in gen_random_strings_from_letters("ABC"):
+        assert array_ws.find_word(word) == tree_ws.find_word(word)
+    print("Done")
+
+def test_node_intervals():
+    print("Testing suffix tree node intervals...", end='')
+    for text in ["ABABAA", "AAAA"] + gen_random_strings_from_letters("AB|"):
+        st = SuffixTreeEfficient(text)
+        st.create_suffix_tree()
+        stack = [st.root]
+        while stack:
+            node = stack.pop()
+            leaves = []
+            collect_leaves(node, leaves)
+            assert sorted(leaves) == sorted(st.suffix_array[node.sa_lo:node.sa_hi])
+            stack.extend(node.children.values())
+    print("Done")
+
+def collect_leaves(node, leaves):
+    if node.occurs is not None:
+        leaves.append(node.occurs)
+    for child in node.children.values():
+        collect_leaves(child, leaves)
+
+def test_compact_suffix_tree():
+    print("Testing compact suffix tree...", end='')
+    for text in ["ABABAA", "QWER|ASDF|QWER"] + gen_random_strings_from_letters("AB|"):
+        st = SuffixTreeEfficient(text)
+        st.create_suffix_tree()
+        cst = CompactSuffixTree(text)
+        cst.create_suffix_tree()
+        assert cst.display_tree() == st.display_tree()
+        for pattern in ["A", "B", "AB", "BA", "ABA", "BAB", "AAA", "C"]:
+            assert cst.find_pattern(pattern) == st.find_pattern(pattern)
+
+    tree_ws = BaseWordSearch("grids/grid4.txt")
+    compact_ws = BaseWordSearch("grids/grid4.txt", index="compact")
+    for word in gen_random_strings_from_letters("ABC"):
+        assert compact_ws.find_word(word) == tree_ws.find_word(word)
+    print("Done")
+
+def test_aho_corasick():
+    print("Testing Aho-Corasick automaton...", end='')
+    patterns = ["A", "AB", "BAB", "ABAB", "C", "", "AB"]
+    automaton = AhoCorasick(patterns)
+    for text in gen_random_strings_from_letters("ABC|"):
+        expected = [(j, i) for i, p in enumerate(patterns) if p != ""
+                    for j in range(len(text)) if text.startswith(p, j)]
+        assert sorted(automaton.search(text)) == sorted(expected)
+    print("Done")
+
+def test_find_words_batch():
+    print("Testing batch find words...", end='')
+    words = gen_random_strings_from_letters("ABC") + ["ABA", "ABA", "Z"]
+    ws = BaseWordSearch("grids/grid4.txt")
+    batch_ws = BaseWordSearch("grids/grid4.txt")
+    assert batch_ws.find_words(words, batch=True) == ws.find_words(words, batch=False)
+    assert batch_ws.show_board(True) == ws.show_board(True)
+
+    # By default, batch mode needs more words the larger the grid
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "grid.txt")
+        with open(path, "w") as f:
+            f.write("\n".join(",".join(random.choice("ABC") for j in range(150))
+                               for i in range(150)))
+        ws = BaseWordSearch(path, index="array", cache_size=0)
+        batches = []
+        find_words_batch = ws._find_words_batch
+        ws._find_words_batch = lambda w, f: batches.append(len(w)) or find_words_batch(w, f)
+        words = [bin(i)[2:].replace("0", "A").replace("1", "B") for i in range(1, 100)]
+        for count, families in [(63, ["rows"]), (64, ["rows"]), (64, None), (90, None)]:
+            ws.find_words(words[:count], families=families)
+        assert batches == [64, 90]
+    print("Done")
+
+def test_find_words_as_array():
+    print("Testing structured array results...", end='')
+    words = gen_random_strings_from_letters("ABC")
+    for wrap in (None, "torus", "raster"):
+        for batch in (False, True):
+            ws = BaseWordSearch("grids/grid4.txt", backwards=True, wrap=wrap)
+            locations = ws.find_words(words, batch=batch)
+            records = BaseWordSearch("grids/grid4.txt", backwards=True,
+                    wrap=wrap).find_words(words, batch=batch, as_array=True)
+            assert records.dtype == MATCH_DTYPE
+            expected = [(i, beg[0], beg[1], end[0], end[1])
+                        for i, loc_info in enumerate(locations) for beg, end in loc_info]
+            fields = ["word_id", "start_row", "start_col", "end_row", "end_col"]
+            assert records[fields].tolist() == expected
+            for record in records:
+                word = words[record["word_id"]]
+                coords = ((record["start_row"], record["start_col"]),
+                          (record["end_row"], record["end_col"]))
+                assert ws.build_string_from_coords(coords) == word
+
+    ws = BaseWordSearch("grids/grid3.txt", backwards=True)
+    records = ws.find_word("SQ", as_array=True)
+    assert records.tolist() == [(0, 1, 1, -1, -1, DIRECTIONS.index("up_left"))]
+    print("Done")
+
+def test_parallel_build():
+    print("Testing parallel index construction...", end='')
+    words = gen_random_strings_from_letters("ABC")
+    for index in ("tree", "compact", "array"):
+        for wrap in (None, "torus", "raster"):
+            ws = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap, backwards=True)
+            parallel = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap,
+                                      backwards=True, workers=2)
+            ws.warm()
+            assert set(parallel.indexes) == set(ws.indexes)
+            for _type in ws.indexes:
+                serial_tree = ws.indexes[_type].tree
+                parallel_tree = parallel.indexes[_type].tree
+                assert list(parallel_tree.suffix_array) == list(serial_tree.suffix_array)
+                assert list(parallel_tree.lcp_array) == list(serial_tree.lcp_array)
+                if index != "array":
+                    assert parallel_tree.display_tree() == serial_tree.display_tree()
+            assert parallel.find_words(words) == ws.find_words(words)
+            assert str(parallel) == str(ws)
+    print("Done")
+
+def test_lazy_indexes():
+    print("Testing lazy index construction...", end='')
+    ws = BaseWordSearch("grids/grid3.txt")
+    assert ws.indexes == {}
+    assert str(ws) == str(BaseWordSearch("grids/grid3.txt", workers=1))
+    assert ws.indexes == {}
+
+    assert ws.find_word("QW", families=["rows"]) == [((0, 0), (0, 2))]
+    assert list(ws.indexes) == ["rows"]
+    assert ws.find_word("QA", families=["rows"]) == []
+    assert ws.find_word("QS", families=["rows", "diag_down"]) == [((0, 0), (2, 2))]
+    assert sorted(ws.indexes) == ["diag_down", "rows"]
+    assert ws.find_words(["QA", "QW"], batch=True, families=["cols"]) == [[((0, 0), (2, 0))], []]
+    assert sorted(ws.indexes) == ["cols", "diag_down", "rows"]
+
+    ws.warm()
+    assert sorted(ws.indexes) == ["cols", "diag_down", "diag_up", "rows"]
+    assert ws.find_word("QS") == [((0, 0), (2, 2))]
+    try:
+        ws.find_word("QS", families=["diagonals"])
+        assert False
+    except ValueError:
+        pass
+    print("Done")
+
+def test_update_cells():
+    print("Testing incremental cell updates...", end='')
+    words = gen_random_strings_from_letters("ABC")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "grid.txt")
+        for index in ("tree", "compact", "array"):
+            for wrap in (None, "torus", "raster"):
+                ws = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap,
+                                    backwards=True, cache_size=0)
+                ws.warm()
+                for _ in range(6):
+                    row, col = random.randrange(ws.rows), random.randrange(ws.cols)
+                    if random.random() < 0.5:
+                        ws.set_cell(row, col, random.choice("ABC"))
+                    else:
+                        ws.update_region(0, col, [random.choice("ABC")
+                                                  for _ in range(ws.rows)])
+                    with open(path, "w") as f:
+                        f.write("\n".join(",".join(line) for line in ws.grid))
+                    fresh = BaseWordSearch(path, index=index, wrap=wrap, backwards=True)
+                    assert str(ws) == str(fresh)
+                    assert ws.find_words(words, batch=False) == fresh.find_words(words, batch=False)
+                    assert ws.find_words(words, batch=True) == fresh.find_words(words, batch=False)
+
+    ws = BaseWordSearch("grids/grid3.txt")
+    ws.warm()
+    ws.find_word("QWE")
+    ws.set_cell(0, 1, "\u0416")
+    assert ws.codes.dtype == np.uint16
+    assert ws.show_board(True).startswith("q \u0416 e ")
+    assert ws.find_word("QWE") == []
+    assert ws.find_word("Q\u0416E") == [((0, 0), (0, 3))]
+    assert ws.find_word("\u0416SX") == [((0, 1), (3, 1))]
+    assert len(ws.line_overlays["rows"]) == 1
+    for method, *bad in [(ws.update_region, 0, 3, ["A"]), (ws.update_region, 2, 0, ["A", "B"]),
+                         (ws.update_region, 0, 0, ["AB", "C"]), (ws.update_region, 0, 0, ["|"]),
+                         (ws.update_region, 0, 0, ["$"]), (ws.set_cell, 0, 0, "$"),
+                         (ws.set_cell, 0, 0, "AB"), (ws.set_cell, 0, 0, "")]:
+        try:
+            method(*bad)
+            assert False, "accepted " + repr(bad)
+        except ValueError:
+            pass
+    assert ws.grid[0].tolist() == ["Q", "\u0416", "E"]
+    print("Done")
+
+def test_query_cache():
+    print("Testing query result cache...", end='')
+    ws = BaseWordSearch("grids/grid3.txt", backwards=True, cache_size=2)
+    uncached = BaseWordSearch("grids/grid3.txt", backwards=True, cache_size=0)
+    assert ws.find_word("QW") == uncached.find_word("QW") == [((0, 0), (0, 2))]
+    assert ws.cache_info() == {"hits": 0, "misses": 1, "size": 1, "capacity": 2}
+
+    # Hits still mark the board
+    ws.matched[:] = False
+    assert ws.find_word("QW") == [((0, 0), (0, 2))]
+    assert ws.show_board(True) == uncached.show_board(True)
+    assert ws.cache_info()["hits"] == 1
+
+    # Results depend on which families are searched
+    assert ws.find_word("QW", families=["cols"]) == []
+    assert ws.find_word("SQ", as_array=True)["direction"].tolist() == [DIRECTIONS.index("up_left")]
+    assert ws.cache_info() == {"hits": 1, "misses": 3, "size": 2, "capacity": 2}
+    # ("QW", all families) was evicted
+    ws.find_word("QW")
+    assert ws.cache_info()["misses"] == 4
+
+    assert ws.find_words(["SQ", "ZZ", "SQ"]) == [[((1, 1), (-1, -1))], [], [((1, 1), (-1, -1))]]
+    records = ws.find_words(["SQ", "SQ"], as_array=True)
+    assert records["word_id"].tolist() == [0, 1]
+    records["start_row"] = 9
+    assert ws.find_word("SQ") == [((1, 1), (-1, -1))]
+
+    ws.set_cell(1, 1, "Q")
+    assert len(ws.query_cache) == 2
+    assert ws.find_word("SQ") == []
+    assert len(ws.query_cache) == 1
+    print("Done")
+
+def test_instrumentation():
+    print("Testing instrumentation...", end='')
+    text = "ABABCABCAB|BCCAB"
+    tree = SuffixTreeEfficient(text, instrumentation=Instrumentation())
+    lcp_calls = []
+    compute_lcp_array = tree._compute_lcp_array
+    tree._compute_lcp_array = lambda: lcp_calls.append(1) or compute_lcp_array()
+    tree.create_suffix_tree()
+    assert lcp_calls == []
+    assert set(tree.stats()["timings"]) == {"suffix_array", "lcp_array", "suffix_tree"}
+
+    compact = CompactSuffixTree(text, instrumentation=Instrumentation())
+    compact.create_suffix_tree()
+    counters = compact.stats()["counters"]
+    assert counters["nodes_created"] == len(compact.parent)
+    assert tree.stats()["counters"] == counters
+    assert counters["nodes_created"] == 1 + len(text) + 1 + counters["edges_broken"]
+
+    for t in (tree, compact):
+        t.find_pattern("CAB")
+        t.find_pattern("CAX")
+        counters = t.stats()["counters"]
+        assert counters["patterns_searched"] == 2
+        assert counters["leaves_enumerated"] == 3
+        assert 6 <= counters["chars_compared"] <= 7
+    assert SuffixTreeEfficient(text).stats() == {"timings": {}, "counters": {}}
+
+    events = []
+    ws = BaseWordSearch("grids/grid3.txt", index="array",
+                        stats_callback=lambda *event: events.append(event))
+    ws.find_words(["QW", "ZZ", "QW"])
+    ws.find_word("QW")
+    stats = ws.stats()
+    assert {"load_grid", "make_lines", "build_index", "suffix_array", "search"} <= \
+        set(stats["timings"])
+    assert stats["counters"]["queries"] == 4
+    assert stats["counters"]["words_searched"] == 2
+    assert stats["counters"]["matches"] == 1
+    assert ("count", "queries", 3) in events
+    assert sum(value for kind, name, value in events if kind == "time" and name == "search") \
+        == stats["timings"]["search"]
+    assert BaseWordSearch("grids/grid3.txt").stats() == {"timings": {}, "counters": {}}
+    print("Done")
+
+def test_contains_and_count():
+    print("Testing contains and count...", end='')
+    words = gen_random_strings_from_letters("ABC") + ["", "AB|", "ABCABCABCA", "$", "R$"]
+    for index in ("tree", "compact", "array"):
+        for wrap in (None, "torus", "raster"):
+            ws = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap,
+                                backwards=True, cache_size=0)
+            for w in words:
+                n = ws.count(w)
+                assert not ws.matched.any()
+                assert n == len(ws.find_word(w))
+                assert ws.contains(w) == (n > 0)
+                ws.matched[:] = False
+            ws.set_cell(0, 0, "C")
+            for w in words:
+                assert ws.count(w, families=["rows"]) == len(ws.find_word(w, families=["rows"]))
+
+    for index in ("tree", "compact", "array"):
+        for backwards in (False, True):
+            ws = BaseWordSearch("grids/grid1.txt", index=index, backwards=backwards)
+            for w in ("$", "R$", "F$", "F|"):
+                assert ws.count(w) == len(ws.find_word(w)) == 0
+                assert not ws.contains(w)
+                assert ws.find_k(w, 2, order="direction") == []
+            assert ws.indexes["rows"].find_pattern("F$") == []
+
+    ws = BaseWordSearch("grids/grid3.txt")
+    assert ws.contains("QW", families=["rows"])
+    assert list(ws.indexes) == ["rows"]
+    assert ws.contains("QS")
+    assert "diag_up" not in ws.indexes
+    assert not ws.contains("SQ")
+
+    st = SuffixTreeEfficient("ABABCABCAB")
+    for built in (False, True):
+        for pattern in ["AB", "CAB", "X", "", "ABCABCABCAB"]:
+            assert st.count_pattern(pattern) == len(st.find_pattern(pattern))
+        st.create_suffix_tree()
+    print("Done")
+
+def test_find_k():
+    print("Testing find first and find k...", end='')
+    words = gen_random_strings_from_letters("ABC") + ["A", "ABCABCABCA"]
+    for index in ("tree", "array"):
+        for wrap in (None, "torus", "raster"):
+            for backwards in (False, True):
+                ws = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap,
+                                    backwards=backwards, cache_size=0)
+                for w in words:
+                    records = ws.find_word(w, as_array=True)
+                    by_start = np.sort(records, order=["start_row", "start_col", "direction"])
+                    for k in (0, 1, 3, len(records) + 1):
+                        ordered = ws.find_k(w, k, as_array=True)
+                        assert ordered.tolist() == by_start[:k].tolist()
+                        assert ws.find_k(w, k, order="direction") == \
+                            ws._coords_from_records(records[:k])
+                    first = ws.find_first(w)
+                    assert first == (ws._coords_from_records(by_start[:1])[0] if len(records) else None)
+                    assert ws.find_first(w, "direction", ["cols"]) == \
+                        (ws.find_word(w, families=["cols"]) or [None])[0]
+
+    ws = BaseWordSearch("grids/grid3.txt")
+    assert ws.find_k("QS", 1, order="direction") == [((0, 0), (2, 2))]
+    assert "diag_up" not in ws.indexes
+    ws.matched[:] = False
+    assert ws.find_first("WS") == ((0, 1), (2, 1))
+    assert ws.show_board(True).split("\n")[0] == "Q w E "
+    for order in ORDERS:
+        assert ws.find_k("WS", 2, order, families=[]) == ws.find_word("WS", families=[]) == []
+        assert ws.find_first("WS", order, families=[]) is None
+    for bad in [("WS", 1, "column_major"), ("WS", -1, "row_major")]:
+        try:
+            ws.find_k(*bad)
+            assert False
+        except ValueError:
+            pass
+    print("Done")
+
+def test_find_word_approx():
+    print("Testing approximate matching...", end='')
+    words = gen_random_strings_from_letters("ABC")[:25] + ["AXC", "ZZZ"]
+    for index in ("tree", "compact", "array"):
+        for wrap in (None, "torus", "raster"):
+            ws = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap,
+                                backwards=True, cache_size=0)
+            for w in words:
+                exact = ws.find_word(w)
+                assert ws.find_word_approx(w, 0) == [(coords, 0) for coords in exact]
+                for k in (1, 2):
+                    approx = ws.find_word_approx(w, k)
+                    assert set(exact) <= set(coords for coords, _ in approx)
+                    for coords, mismatches in approx:
+                        found = ws.build_string_from_coords(coords)
+                        assert len(found) == len(w)
+                        assert mismatches == sum(a != b for a, b in zip(found, w)) <= k
+                    # Every variant with one letter replaced is found exactly
+                    if k == 1 and 0 < len(w) < 5:
+                        variants = set(w[:i] + c + w[i+1:] for i in range(len(w)) for c in "ABC")
+                        expected = set(coords for v in variants for coords in ws.find_word(v))
+                        assert expected == set(coords for coords, _ in approx)
+
+    for index in ("tree", "compact", "array"):
+        for backwards in (False, True):
+            ws = BaseWordSearch("grids/grid1.txt", index=index, backwards=backwards)
+            for w in ("$", "F$", "$F"):
+                assert ws.find_word_approx(w, 0) == ws.find_word_approx(w, 1) == []
+    for built in (False, True):
+        st = SuffixTreeEfficient("ABCAB")
+        if built:
+            st.create_suffix_tree()
+        assert sorted(st.find_pattern_approx("B$", 0)) == [(4, 0)]
+        assert sorted(st.find_pattern_approx("AB$A", 1)) == [(0, 1)]
+
+    ws = BaseWordSearch("grids/grid3.txt", cache_size=0)
+    records = ws.find_word_approx("QXE", 1, as_array=True)
+    assert records[["start_row", "start_col", "mismatches"]].tolist() == [(0, 0, 1)]
+    ws.set_cell(0, 1, "X")
+    assert ws.find_word_approx("QXE", 1) == [(((0, 0), (0, 3)), 0)]
+    try:
+        ws.find_word_approx("QXE", -1)
+        assert False
+    except ValueError:
+        pass
+    print("Done")
+
+def has_path(grid, word, path=()):
+    """
+    Brute force check for a path of adjacent cells spelling word
+    """
+    if len(path) == len(word):
+        return True
+    rows, cols = grid.shape
+    if path:
+        row, col = path[-1]
+        cells = [(row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+    else:
+        cells = [(r, c) for r in range(rows) for c in range(cols)]
+    return any(0 <= r < rows and 0 <= c < cols and (r, c) not in path and
+               grid[r, c] == word[len(path)] and has_path(grid, word, path + ((r, c),))
+               for r, c in cells)
+
+def test_boggle_solver():
+    print("Testing adjacent cell path search...", end='')
+    bs = BoggleSolver("grids/grid3.txt")
+    found = dict(bs.solve(["QWE", "QSC", "QAZXCDEW", "WSXDE", "QSQ", "QZ", "", "QWE"]))
+    assert found == {"QWE": [(0, 0), (0, 1), (0, 2)],
+                     "QSC": [(0, 0), (1, 1), (2, 2)],
+                     "QAZXCDEW": [(0, 0), (1, 0), (2, 0), (2, 1), (2, 2), (1, 2), (0, 2), (0, 1)],
+                     "WSXDE": [(0, 1), (1, 1), (2, 1), (1, 2), (0, 2)]}
+    assert bs.show_board(silent=True) == "q w e \na s d \nz x c "
+    assert dict(BoggleSolver("grids/grid3.txt", wrap="torus").solve(["QZ", "QC"])) == \
+        {"QZ": [(0, 0), (2, 0)], "QC": [(0, 0), (2, 2)]}
+
+    bs = BoggleSolver("grids/grid4.txt")
+    words = gen_random_strings_from_letters("ABC")
+    found = bs.solve(words)
+    assert sorted(word for word, path in found) == \
+        sorted(set(w for w in words if w and has_path(bs.grid, w)))
+    for word, path in found:
+        assert len(set(path)) == len(path)
+        assert all(max(abs(r1 - r2), abs(c1 - c2)) == 1
+                   for (r1, c1), (r2, c2) in zip(path, path[1:]))
+        assert "".join(bs.grid[r, c] for r, c in path) == word
+    try:
+        BoggleSolver("grids/grid3.txt", wrap="raster")
+        assert False
+    except ValueError:
+        pass
+    print("Done")
+
+def test_server():
+    print("Testing query server...", end='')
+    ws = BaseWordSearch("grids/grid4.txt", backwards=True)
+    words = gen_random_strings_from_letters("ABC")[:20]
+
+    def client_calls(address):
+        with WordSearchClient(address) as client:
+            assert client.find_word("grid3", "QWE") == [((0, 0), (0, 3))]
+            assert client.find_word("grid3", "EWQ") == [((0, 2), (0, -1))]
+            assert client.contains("grid3", "ASD")
+            assert client.find_word("grid3", "E$") == []
+            assert not client.contains("grid3", "ASD", families=["cols"])
+            assert client.find_words("grid4", words) == ws.find_words(words)
+            for grid, word, families in (("grid9", "QWE", None), ("grid3", "QWE", ["x"])):
+                try:
+                    client.find_word(grid, word, families)
+                    assert False
+                except ValueError:
+                    pass
+            # Errors leave the connection usable
+            assert client.find_word("grid4", words[0]) == ws.find_word(words[0])
+
+    async def check():
+        server = WordSearchServer({"grid3": "grids/grid3.txt", "grid4": "grids/grid4.txt"},
+                                  workers=1, backwards=True)
+        await server.start(port=0)
+        try:
+            await asyncio.to_thread(client_calls, server.address())
+            for line in (b"not json", b"[1]", b'{"op": "delete", "grid": "grid3"}',
+                         b'{"id": 7, "op": "find_words", "grid": "grid3", "words": "QWE"}'):
+                response = await server.respond(line)
+                assert set(response) == {"id", "error"}
+            assert response["id"] == 7
+            response = await server.respond(b'{"id": 8, "op": "find_word", "grid": "grid3", "word": "E$"}')
+            assert response == {"id": 8, "result": []}
+            # Failures other than bad input are answered too
+            server.executor.shutdown()
+            response = await server.respond(b'{"id": 9, "op": "contains", "grid": "grid3", "word": "QW"}')
+            assert response["id"] == 9 and response["error"].startswith("RuntimeError")
+        finally:
+            await server.close()
+
+    asyncio.run(check())
+    try:
+        WordSearchServer({"grid3": "grids/grid3.txt"}, wrap="spiral")
+        assert False
+    except ValueError:
+        pass
+    print("Done")
+
+def test_index_cache():
+    print("Testing on-disk index cache...", end='')
+    words = gen_random_strings_from_letters("ABC")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for index in ("tree", "compact", "array"):
+            for wrap in (None, "torus", "raster"):
+                ws = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap)
+                expected = ws.find_words(words, batch=False)
+                built = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap,
+                                       cache_dir=cache_dir)
+                loaded = BaseWordSearch("grids/grid4.txt", index=index, wrap=wrap,
+                                        cache_dir=cache_dir, cache_size=0)
+                assert built.find_words(words, batch=False) == expected
+                assert loaded.find_words(words, batch=False) == expected
+                assert loaded.find_words(words, batch=True) == expected
+                assert str(loaded) == str(ws)
+                # Suffix trees are read back as saved, without building nodes
+                if index != "array":
+                    assert all(isinstance(loaded.indexes[_type].tree, CompactSuffixTree)
+                               for _type in loaded.indexes)
+        assert len(os.listdir(cache_dir)) == 9
+
+        # A file written by another format version is rebuilt
+        for name in os.listdir(cache_dir):
+            with open(os.path.join(cache_dir, name), "r+b") as f:
+                f.seek(8)
+                f.write(b"\xff")
+        try:
+            IndexCache.load_arrays(os.path.join(cache_dir, name))
+            assert False, "stale index file was loaded"
+        except ValueError:
+            pass
+        rebuilt = BaseWordSearch("grids/grid4.txt", index="array", cache_dir=cache_dir)
+        assert rebuilt.find_words(words, batch=False) == \
+            BaseWordSearch("grids/grid4.txt").find_words(words, batch=False)
+
+        # So is an empty or truncated file
+        for name in os.listdir(cache_dir):
+            open(os.path.join(cache_dir, name), "wb").close()
+        try:
+            IndexCache.load_arrays(os.path.join(cache_dir, name))
+            assert False, "empty index file was loaded"
+        except ValueError:
+            pass
+        rebuilt = BaseWordSearch("grids/grid4.txt", index="tree", cache_dir=cache_dir)
+        assert rebuilt.find_words(words, batch=False) == \
+            BaseWordSearch("grids/grid4.txt").find_words(words, batch=False)
+    print("Done")
+
 def test_build_string_from_coords():
     print("Testing build string from coords...", end="")
 
@@ -144,13 +884,44 @@ def test_show_board():
     ws = BaseWordSearch("grids/grid3.txt")
     ws.find_words(["ZSE", "QS", "ED", "C"])
     assert repr(ws.show_board(True)) == repr('q W e \nA s d \nz X c ')
+    assert ws.matched.sum() == 6
+    assert ws.board[0][0] == "q" and ws.board[0][1] == "W"
+
+    try:
+        ws._update_board([((0, 0), (1, 2))])
+        assert False
+    except ValueError:
+        pass
 
     print("Done")
 
 def main():
     test_load_csv()
+    test_load_csv_bytes()
     test_str_()
     test_find_word()
+    test_find_word_repeated_letters()
+    test_find_word_backwards()
+    test_find_word_torus()
+    test_find_word_raster()
+    test_suffix_array_engines()
+    test_find_interval()
+    test_node_intervals()
+    test_compact_suffix_tree()
+    test_aho_corasick()
+    test_find_words_batch()
+    test_find_words_as_array()
+    test_parallel_build()
+    test_lazy_indexes()
+    test_update_cells()
+    test_query_cache()
+    test_instrumentation()
+    test_contains_and_count()
+    test_find_k()
+    test_find_word_approx()
+    test_boggle_solver()
+    test_server()
+    test_index_cache()
     test_build_string_from_coords()
     test_show_board()
 